@@ -1,6 +1,17 @@
 from dynatrace_extension import Extension, Status, StatusValue
-import requests, traceback 
-from datetime import datetime, timezone, timedelta
+import sys, threading, traceback
+from datetime import datetime, timezone
+
+from .api_client import DynatraceApiClient
+from .backfill import main as backfill_main
+from .cassette import CassetteRecorder
+from .collection import DEFAULT_MAX_CONCURRENT_REQUESTS
+from .metadata_cache import DEFAULT_METADATA_CACHE_TTL_MIN, MetadataCache
+from .pipeline import run_collection_cycle
+from .replay import main as replay_main
+from .scheduling import CycleDeadline, EndpointScheduler
+from .time_windows import DEFAULT_MAX_CATCH_UP_MIN, WindowTracker
+from .topology_index import TopologyIndex
 
 class ExtensionImpl(Extension):
 
@@ -10,34 +21,49 @@ class ExtensionImpl(Extension):
         """
         self.logger.info("Initializing azure_ddu_monitoring.")
 
-        for endpoint in self.activation_config["endpoints"]:
+        # API clients (pooled HTTP sessions) by environment URL and API token, reused across collection cycles
+        self.api_clients = {}
+        self.api_clients_lock = threading.Lock()
 
-            # Dynatrace Tenant URL | Managed: https://{your-domain}/e/{your-environment-id} | SaaS: https://{your-environment-id}.live.dynatrace.com
-            environment_url = endpoint["environment_url"]
+        # Metadata caches (subscriptions and entities) by environment URL, reused across collection cycles
+        self.metadata_caches = {}
+        self.metadata_caches_lock = threading.Lock()
 
-            # API Token with following permissions: Read entities, Read metrics
-            api_token = endpoint["api_token"]
+        # Trackers of the last reported time window by endpoint (environment URL, API token, query interval and reporting mode)
+        self.window_trackers = {}
+        self.window_trackers_lock = threading.Lock()
 
-            # Query interval in minutes to collect DDU consumption (Minimum: 15 min)
-            query_interval_min = endpoint["query_interval_min"]
+        # Topology indexes (subscription of every Azure entity) by environment URL, shared by all endpoints of an environment
+        self.topology_indexes = {}
+        self.topology_indexes_lock = threading.Lock()
+
+        # Environment URLs and reporting modes whose first cycle was recorded to a cassette
+        self.recorded_endpoints = set()
+        self.recorded_endpoints_lock = threading.Lock()
+
+        endpoints = self.activation_config["endpoints"]
 
-            # Reporting mode - if enabled summarize consumption by Azure subscription otherwise by Azure entity
-            summarize_by_subscription = endpoint["summarize_by_subscription"]
+        # Staggers endpoints and bounds concurrent requests across endpoints
+        self.endpoint_scheduler = EndpointScheduler([endpoint.get("max_concurrent_requests", DEFAULT_MAX_CONCURRENT_REQUESTS) for endpoint in endpoints])
 
-            # Enable/disable verify SSL certificate for API requests
-            verify_ssl = endpoint["verify_ssl"]
+        for index, endpoint in enumerate(endpoints):
 
             # ================================================================================================
             # ================================================================================================
 
-            # Schedule main function according to query interval
+            # Schedule main function with the endpoint config (fields are read in report_azure_consumption) according to its
+            # query interval and offset from the other endpoints (the SDK skips overlapping cycles)
+            query_interval_min = endpoint["query_interval_min"]
+            offset_seconds = self.endpoint_scheduler.offset_seconds(index, len(endpoints), query_interval_min*60)
+
             self.schedule(
                 self.report_azure_consumption, 
                 query_interval_min*60, 
-                args=(environment_url, api_token, query_interval_min, summarize_by_subscription, verify_ssl)
+                args=(endpoint,),
+                offset_seconds=offset_seconds
                 )
 
-            self.logger.info(f"Scheduled query for endpoint with url '{environment_url}' and {query_interval_min} min interval")
+            self.logger.info(f"Scheduled query for endpoint with url '{endpoint['environment_url']}' and {query_interval_min} min interval, first run in {offset_seconds:.0f}s")
 
             # ================================================================================================
             # ================================================================================================
@@ -53,338 +79,176 @@ class ExtensionImpl(Extension):
         If this AG cannot run this extension, raise an Exception or return StatusValue.ERROR!
         """
         return Status(StatusValue.OK)
+
+    def get_api_client(self, environment_url, api_token, verify_ssl, pool_size):
+        """
+        Returns the API client of the given environment, creating it on first use
+        """
+        with self.api_clients_lock:
+            key = (environment_url, api_token, verify_ssl)
+            if key not in self.api_clients:
+                self.api_clients[key] = DynatraceApiClient(environment_url, api_token, verify_ssl, pool_size, self.logger, self.endpoint_scheduler.request_budget)
+            return self.api_clients[key]
+
+    def get_metadata_cache(self, environment_url, ttl_min, persist):
+        """
+        Returns the metadata cache of the given environment, creating (and loading) it on first use
+        """
+        if ttl_min <= 0:
+            return None
+
+        with self.metadata_caches_lock:
+            if environment_url not in self.metadata_caches:
+                path = MetadataCache.default_path(environment_url) if persist else None
+                self.metadata_caches[environment_url] = MetadataCache(ttl_min*60, path=path)
+            return self.metadata_caches[environment_url]
+
+    def get_topology_index(self, environment_url):
+        """
+        Returns the topology index of the given environment, creating it on first use
+        """
+        with self.topology_indexes_lock:
+            if environment_url not in self.topology_indexes:
+                self.topology_indexes[environment_url] = TopologyIndex()
+            return self.topology_indexes[environment_url]
+
+    def start_recording(self, environment_url, summarize_by_subscription):
+        """
+        Returns True if the cycle of the given environment and reporting mode is the first one and should be recorded
+        """
+        with self.recorded_endpoints_lock:
+            key = (environment_url, summarize_by_subscription)
+            if key in self.recorded_endpoints:
+                return False
+            self.recorded_endpoints.add(key)
+            return True
+
+    def get_window_tracker(self, environment_url, api_token, query_interval_min, summarize_by_subscription, max_catch_up_min):
+        """
+        Returns the window tracker of the given endpoint, creating (and loading) it on first use
+
+        Endpoints differing in any of environment URL, API token, query interval or reporting
+        mode have trackers of their own, so they never take each other's windows.
+        """
+        with self.window_trackers_lock:
+            key = (environment_url, api_token, query_interval_min, summarize_by_subscription)
+            if key not in self.window_trackers:
+                # The file name is a hash of the key, so the API token is not written to disk
+                path = WindowTracker.default_path(f"{environment_url}|{api_token}|{query_interval_min}|{summarize_by_subscription}")
+                self.window_trackers[key] = WindowTracker(max_catch_up_min*60, path, self.logger)
+            return self.window_trackers[key]
     
-    def report_azure_consumption(self, environment_url, api_token, query_interval_min, summarize_by_subscription, verify_ssl):
+    def report_azure_consumption(self, endpoint):
 
         # ================================================================================================
         # ================================================================================================
 
-        # Collect and report metric DDU consumption for Azure services
+        # Collect and report metric DDU consumption for Azure services of the endpoint (one entry of the activation config)
 
         # ================================================================================================
         # ================================================================================================
 
-        try:
-            self.logger.info("Query method started for azure_ddu_monitoring.")
+        # Dynatrace Tenant URL | Managed: https://{your-domain}/e/{your-environment-id} | SaaS: https://{your-environment-id}.live.dynatrace.com
+        environment_url = endpoint["environment_url"]
 
-            MONITORED_ENTITIES_API = environment_url + "/api/v2/entities"
-            METRICS_QUERY_API = environment_url + "/api/v2/metrics/query"
-
-            datetime_to = datetime.now(timezone.utc)
-            datetime_from = datetime_to - timedelta(minutes=query_interval_min)
-
-            TIME_TO = datetime_to.isoformat(timespec='milliseconds')
-            TIME_FROM = datetime_from.isoformat(timespec='milliseconds')
-
-            # Class for mapping DDU consumption to Azure entities and their Azure subscriptions
-            class ConsumptionRecord:
-
-                # Constructor function    
-                def __init__(self, 
-                            entity_id = "Undefined", 
-                            entity_name = "Undefined", 
-                            entity_type = "Undefined", 
-                            subscription_id = "Undefined", 
-                            subscription_name = "Undefined", 
-                            metric_ddus = 0):
-                    
-                    self.entity_id = entity_id
-                    self.entity_name = entity_name
-                    self.entity_type = entity_type
-                    self.subscription_id = subscription_id
-                    self.subscription_name = subscription_name
-                    self.metric_ddus = metric_ddus
-
-            # List of Azure Classic entity types relevant for consumption reporting
-            CLASSIC_TYPES = [
-                "AZURE_API_MANAGEMENT_SERVICE",
-                "AZURE_REDIS_CACHE",
-                "AZURE_VM",
-                "AZURE_VM_SCALE_SET",
-                "AZURE_IOT_HUB",
-                "AZURE_COSMOS_DB",
-                "AZURE_EVENT_HUB_NAMESPACE",
-                "AZURE_EVENT_HUB",
-                "AZURE_APPLICATION_GATEWAY",
-                "AZURE_LOAD_BALANCER",
-                "AZURE_SERVICE_BUS_NAMESPACE",
-                "AZURE_SERVICE_BUS_TOPIC",
-                "AZURE_SERVICE_BUS_QUEUE",
-                "AZURE_SQL_SERVER",
-                "AZURE_SQL_DATABASE",
-                "AZURE_SQL_ELASTIC_POOL",
-                "AZURE_STORAGE_ACCOUNT"
-            ]
+        # API Token with following permissions: Read entities, Read metrics
+        api_token = endpoint["api_token"]
 
-            # Dictionary for consumption data by entity ID
-            entity_dict = {}
+        # Query interval in minutes to collect DDU consumption (Minimum: 15 min)
+        query_interval_min = endpoint["query_interval_min"]
 
-            # Dictionary for Azure Subscriptions by entity ID
-            subscription_entity_dict = {}
+        # Reporting mode - if enabled summarize consumption by Azure subscription otherwise by Azure entity
+        summarize_by_subscription = endpoint["summarize_by_subscription"]
 
+        # Enable/disable reporting consumption summarized by entity type in addition
+        summarize_by_entity_type = endpoint.get("summarize_by_entity_type", False)
 
-            # Fetch all Azure Subscription entities
-            # ================================================================================================
+        # Enable/disable verify SSL certificate for API requests
+        verify_ssl = endpoint["verify_ssl"]
 
-            params = { 
-                "api-token": api_token, 
-                "pageSize": 500,
-                "entitySelector": "type(AZURE_SUBSCRIPTION)",
-                "fields": "+properties",
-                "from": "now-24h", 
-                "to": TIME_TO
-            }
-
-            next_page_key = ""
-            while(True):
-                if next_page_key:
-                    params = { 
-                        "api-token": api_token, 
-                        "nextPageKey": next_page_key 
-                    }
-                response = requests.get(MONITORED_ENTITIES_API, params, verify=verify_ssl)
-                json = response.json()
-
-                subscription_entities = json["entities"]
-                for subscription_entity in subscription_entities:
-                    subscription_entity_dict[subscription_entity["entityId"]] = {
-                        "subscription_id": subscription_entity["properties"]["azureSubscriptionUuid"],
-                        "subscription_name": subscription_entity["displayName"]
-                    }
-
-                next_page_key = json.get("nextPageKey")
-                if not next_page_key:
-                    break
-
-            self.logger.info(f"Fetched {len(subscription_entity_dict)} Azure Subscriptions.")
-
-
-            # Collect DDU metric consumption for each Azure subscription
-            # ================================================================================================
+        # Maximum number of API queries running in parallel for this endpoint
+        max_concurrent_requests = endpoint.get("max_concurrent_requests", DEFAULT_MAX_CONCURRENT_REQUESTS)
 
-            for subscription_entity_id in subscription_entity_dict:
-            
-                subscription_id = subscription_entity_dict[subscription_entity_id]["subscription_id"]
-                subscription_name = subscription_entity_dict[subscription_entity_id]["subscription_name"]
-
-                self.logger.info(f"Collecting consumption of Cloud Azure entities for subscription {subscription_id} / {subscription_name}.")
-
-                # Fetch billed DDUs of Cloud Azure entities for the given Azure subscription
-                # ================================================================================================
-                metric_consumption_list = []
-                metric_selector = f"builtin:billing.ddu.metrics.byEntity:filter(in(\"dt.entity.monitored_entity\", entitySelector(\"type(~\"CUSTOM_DEVICE~\"),fromRelationship.belongsTo(type(~\"AZURE_SUBSCRIPTION~\"),azureSubscriptionUuid({subscription_id}))\"))):splitBy(\"dt.entity.monitored_entity\"):fold(sum)"
-                params = {
-                    "api-token": api_token, 
-                    "metricSelector": metric_selector,
-                    "from": TIME_FROM,
-                    "to": TIME_TO,
-                    "pageSize": 10000
-                }
-                
-                next_page_key = ""
-                while(True):
-                    if next_page_key:
-                        params = { 
-                            "api-token": api_token, 
-                            "nextPageKey": next_page_key 
-                        }
-                    response = requests.get(METRICS_QUERY_API, params, verify=verify_ssl)
-                    json = response.json()
-                    
-                    metric_consumption_list.extend(json["result"][0]["data"])
-                    
-                    next_page_key = json.get("nextPageKey")
-                    if not next_page_key:
-                        break
-
-                self.logger.info(f"Fetched consumption for {len(metric_consumption_list)} entities of subscription {subscription_id}.")
-
-
-                # Fetch Cloud Azure entities for the given Azure subscription
-                # ================================================================================================
-                azure_entities = []
-                entity_selector = f"type(CUSTOM_DEVICE),fromRelationships.belongsTo(type(AZURE_SUBSCRIPTION),azureSubscriptionUuid({subscription_id}))"
-                params = { 
-                    "api-token": api_token, 
-                    "pageSize": 500,
-                    "entitySelector": entity_selector,
-                    "from": "now-24h", 
-                    "to": TIME_TO
-                }
-
-                next_page_key = ""
-                while(True):
-                    if next_page_key:
-                        params = { 
-                            "api-token": api_token, 
-                            "nextPageKey": next_page_key 
-                        }
-                    response = requests.get(MONITORED_ENTITIES_API, params, verify=verify_ssl)
-                    json = response.json()
-
-                    azure_entities.extend(json["entities"])
-
-                    next_page_key = json.get("nextPageKey")
-                    if not next_page_key:
-                        break
-
-                self.logger.info(f"Fetched {len(azure_entities)} Cloud Azure entities of subscription {subscription_id}.")
-
-                # Create consumption records per Azure entity
-                # ================================================================================================
-
-                for metric_consumption in metric_consumption_list:
-                
-                    entity_id = metric_consumption["dimensionMap"]["dt.entity.monitored_entity"]
-                    metric_ddus = metric_consumption["values"][0]
-
-                    entity = next((azure_entity for azure_entity in azure_entities if azure_entity["entityId"] == entity_id), None)
-                    
-                    if (entity is not None):
-                        entity_name = entity["displayName"]
-                        entity_type = entity["type"]
-
-                    entity_dict[entity_id] = ConsumptionRecord(entity_id, entity_name, entity_type, subscription_id, subscription_name, metric_ddus)
-
-
-            # Collect DDU metric consumption for each Classic Azure entity type
-            # ================================================================================================
+        # Time to live in minutes of cached subscription and entity metadata (0: no caching)
+        metadata_cache_ttl_min = endpoint.get("metadata_cache_ttl_min", DEFAULT_METADATA_CACHE_TTL_MIN)
 
-            self.logger.info(f"Collecting consumption of Classic Azure entities for all subscriptions.")
-
-            for classic_type in CLASSIC_TYPES:
-                
-                # Fetch billed DDUs for given Classic type
-                # ================================================================================================
-                classic_metric_consumption_list = []
-                metric_selector = f"builtin:billing.ddu.metrics.byEntity:filter(prefix(\"dt.entity.monitored_entity\", {classic_type})):splitBy(\"dt.entity.monitored_entity\"):fold(sum):names"
-                params = {
-                    "api-token": api_token, 
-                    "metricSelector": metric_selector,
-                    "from": TIME_FROM,
-                    "to": TIME_TO,
-                    "pageSize": 10000
-                }
-                
-                next_page_key = ""
-                while(True):
-                    if next_page_key:
-                        params = { 
-                            "api-token": api_token, 
-                            "nextPageKey": next_page_key 
-                        }
-                    response = requests.get(METRICS_QUERY_API, params, verify=verify_ssl)
-                    json = response.json()
-                    
-                    classic_metric_consumption_list.extend(json["result"][0]["data"])
-                    
-                    next_page_key = json.get("nextPageKey")
-                    if not next_page_key:
-                        break 
-                
-                self.logger.info(f"Fetched consumption for {len(classic_metric_consumption_list)} Azure entities of Classic type {classic_type}.")
-
-                # Fetch entities for given Classic type
-                # ================================================================================================
-
-                if len(classic_metric_consumption_list) > 0:
-                    
-                    classic_entities = []
-                    params = { 
-                        "api-token": api_token, 
-                        "pageSize": 500,
-                        "entitySelector": f"type({classic_type})",
-                        "fields": "+fromRelationships.isAccessibleBy",
-                        "from": "now-24h", 
-                        "to": TIME_TO
-                    }
-                    next_page_key = ""
-                    while(True):
-                        if next_page_key:
-                            params = { 
-                                "api-token": api_token, 
-                                "nextPageKey": next_page_key 
-                            }
-                        response = requests.get(MONITORED_ENTITIES_API, params, verify=verify_ssl)
-                        json = response.json()
-
-                        classic_entities.extend(json["entities"])
-
-                        next_page_key = json.get("nextPageKey")
-                        if not next_page_key:
-                            break
-
-                    self.logger.info(f"Fetched {len(classic_metric_consumption_list)} entities of Classic type {classic_type}.")
-
-                    # Create consumption records per Azure entity for given Classic type
-                    # ================================================================================================
-                    for classic_metric_consumption in classic_metric_consumption_list:
-
-                        entity_id = classic_metric_consumption["dimensionMap"]["dt.entity.monitored_entity"]
-                        entity_name = classic_metric_consumption["dimensionMap"]["dt.entity.monitored_entity.name"]
-                        entity_type = entity_id.split("-")[0] # e.g. AZURE_WEB_APP-F0991A85FA6C2703
-                        metric_ddus = classic_metric_consumption["values"][0]
-
-                        entity = next((classic_entity for classic_entity in classic_entities if classic_entity["entityId"] == entity_id), None)
-
-                        if (entity is not None):
-                            subscription_entity = next((accessible_by for accessible_by in entity["fromRelationships"]["isAccessibleBy"] if accessible_by["type"] == "AZURE_SUBSCRIPTION"), None)
-
-                            if (subscription_entity is not None):
-                                subscription_entity_id = subscription_entity["id"]
-                                subscription_id = subscription_entity_dict[subscription_entity_id]["subscription_id"]
-                                subscription_name = subscription_entity_dict[subscription_entity_id]["subscription_name"]
-                        
-                        entity_dict[entity_id] = ConsumptionRecord(entity_id, entity_name, entity_type, subscription_id, subscription_name, metric_ddus)
-
-
-            self.logger.info(f"Finished collection for total {len(entity_dict)} entities.")
-
-            # Report consumption either by Azure subscription or Azure entity
-            # ================================================================================================
-            metric_lines = []
-
-            if summarize_by_subscription:
-
-                # Report consumption by Azure subscription
-                # ================================================================================================
-                subscription_dict = {}
-                
-                # Summarize consumption by subscription
-                for record in entity_dict.values():
-                    if record.subscription_id in subscription_dict:
-                        subscription_dict[record.subscription_id][metric_ddus] += record.metric_ddus
-                    else:
-                        subscription_dict[record.subscription_id] = {
-                            "subscription_id": record.subscription_id,
-                            "subscription_name": record.subscription_name,
-                            "metric_ddus": record.metric_ddus
-                        }
-                
-                for subscription in subscription_dict.values():
-                    dimensions = f"azure.subscription.id={subscription['subscription_id']},azure.subscription.name={subscription['subscription_name']},environment.url={environment_url}"
-                    metric_line = f"consumption.ddu.metrics.azure.ddus_by_subscription,{dimensions} {subscription['metric_ddus']}"
-                    metric_lines.append(metric_line)
-            
-            else:
-                # Report consumption by Azure entity
-                # ================================================================================================
-                for record in entity_dict.values():
-                    dimensions = f"dt.entity.custom_device={record.entity_id},entity.name={record.entity_name},entity.type={record.entity_type},azure.subscription.id={record.subscription_id},azure.subscription.name={record.subscription_name},environment.url={environment_url}"
-                    
-                    metric_line = f"consumption.ddu.metrics.azure.ddus_by_entity,{dimensions} {record.metric_ddus}"
-                    metric_lines.append(metric_line)
-            
-            # Report metrics according to metric line protocol in batches
-            # ================================================================================================
-            if metric_lines:
-                batch_size = 500
-                batches = [metric_lines[i:i + batch_size] for i in range(0, len(metric_lines), batch_size)]
+        # Enable/disable persisting cached metadata to disk, so restarts start with a warm cache
+        persist_metadata_cache = endpoint.get("persist_metadata_cache", False)
 
-                for batch in batches:
-                    self.report_mint_lines(batch)
+        # Enable/disable reporting duration, requests and entities per collection phase as selfmon metrics
+        report_self_monitoring = endpoint.get("report_self_monitoring", False)
 
-                self.logger.info(f"Successfully reported {len(metric_lines)} consumption metrics.")
+        # Time range in minutes caught up after missed or failed cycles (0: no catch-up)
+        max_catch_up_min = endpoint.get("max_catch_up_min", DEFAULT_MAX_CATCH_UP_MIN)
+
+        # Enable/disable resolving subscriptions of all entities with one bulk topology query instead of listings per subscription
+        use_topology_index = endpoint.get("use_topology_index", True)
+
+        # Enable/disable recording the API responses of the first cycle to a cassette file for offline replay and profiling
+        record_cassette = endpoint.get("record_cassette", False)
+
+        # Reports the cycle if it is still running at its deadline (the SDK only warns once it returned)
+        deadline = CycleDeadline(environment_url, query_interval_min*60, self.logger)
+
+        try:
+            self.logger.info("Query method started for azure_ddu_monitoring.")
+
+            # Minute aligned windows since the last reported window, the last one ending now
+            window_tracker = self.get_window_tracker(environment_url, api_token, query_interval_min, summarize_by_subscription, max_catch_up_min)
+            windows = window_tracker.pending_windows(query_interval_min*60)
+            if not windows:
+                self.logger.info("No new time window to report.")
+                return
+
+            *catch_up_windows, (window_from, window_to) = windows
+
+            TIME_TO = datetime.fromtimestamp(window_to, timezone.utc).isoformat(timespec='milliseconds')
+            TIME_FROM = datetime.fromtimestamp(window_from, timezone.utc).isoformat(timespec='milliseconds')
+
+            if catch_up_windows:
+                self.logger.info(f"Catching up {len(catch_up_windows)} missed time windows since {datetime.fromtimestamp(catch_up_windows[0][0], timezone.utc).isoformat()}.")
+
+            CATCH_UP_WINDOWS = [
+                (datetime.fromtimestamp(start, timezone.utc).isoformat(timespec='milliseconds'), datetime.fromtimestamp(end, timezone.utc).isoformat(timespec='milliseconds'), end*1000)
+                for start, end in catch_up_windows
+            ]
+
+            api_client = self.get_api_client(environment_url, api_token, verify_ssl, max_concurrent_requests)
+            metadata_cache = self.get_metadata_cache(environment_url, metadata_cache_ttl_min, persist_metadata_cache)
+            topology_index = self.get_topology_index(environment_url) if use_topology_index else None
+
+            # The recorded cycle runs cold (without cached metadata and shared topology), so the cassette contains every response a replay needs
+            recorder = None
+            if record_cassette and self.start_recording(environment_url, summarize_by_subscription):
+                recorder = CassetteRecorder(CassetteRecorder.default_path(f"{environment_url}|{summarize_by_subscription}"), {
+                    "environment_url": environment_url,
+                    "recorded_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    "time_from": TIME_FROM,
+                    "time_to": TIME_TO,
+                    "catch_up_windows": CATCH_UP_WINDOWS,
+                    "summarize_by_subscription": summarize_by_subscription,
+                    "summarize_by_entity_type": summarize_by_entity_type,
+                    "max_concurrent_requests": max_concurrent_requests,
+                    "report_self_monitoring": report_self_monitoring,
+                    "use_topology_index": use_topology_index
+                })
+                api_client = DynatraceApiClient(environment_url, api_token, verify_ssl, max_concurrent_requests, self.logger, self.endpoint_scheduler.request_budget, recorder)
+                metadata_cache = None
+                topology_index = TopologyIndex() if use_topology_index else None
+
+            # Collect and report DDU metric consumption of Cloud and Classic Azure entities for all subscriptions
+            # ================================================================================================
+            # Only reported windows are skipped by the next cycle, they are committed right after their lines were released
+            try:
+                run_collection_cycle(self.logger, api_client, TIME_FROM, TIME_TO, self.report_mint_lines, summarize_by_subscription, max_concurrent_requests, metadata_cache, report_self_monitoring, CATCH_UP_WINDOWS, summarize_by_entity_type, topology_index, commit=lambda: window_tracker.commit(window_to))
+            finally:
+                if recorder is not None:
+                    api_client.close()
+                    try:
+                        recorder.close()
+                        self.logger.info(f"Recorded {recorder.response_count} API responses to cassette {recorder.path}.")
+                    except OSError as e:
+                        self.logger.warning(f"Could not write cassette {recorder.path}: {e}")
 
             self.logger.info("Query method ended for azure_ddu_monitoring.")
 
@@ -392,7 +256,18 @@ class ExtensionImpl(Extension):
             self.logger.error("ERROR WHILE REPORTING AZURE CONSUMPTION")
             self.logger.error(traceback.format_exc())
 
+        finally:
+            deadline.finish()
+
 def main():
+    # python -m azure_ddu_monitoring backfill ... writes the consumption of a past time range to a file
+    if sys.argv[1:2] == ["backfill"]:
+        return backfill_main(sys.argv[2:])
+
+    # python -m azure_ddu_monitoring replay CASSETTE ... replays (and profiles) a recorded cycle
+    if sys.argv[1:2] == ["replay"]:
+        return replay_main(sys.argv[2:])
+
     ExtensionImpl(name="azure_ddu_monitoring").run()
 
 
@@ -0,0 +1,141 @@
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .instrumentation import record_request
+from .request_scheduler import RequestScheduler
+
+MONITORED_ENTITIES_PATH = "/api/v2/entities"
+METRICS_QUERY_PATH = "/api/v2/metrics/query"
+
+# Page sizes used for paginated queries (maximum supported by the respective API)
+ENTITIES_PAGE_SIZE = 500
+METRICS_PAGE_SIZE = 10000
+
+# Connect and read timeout in seconds of API requests
+REQUEST_TIMEOUT = (10, 120)
+
+
+class DynatraceApiError(Exception):
+    """
+    Raised for API responses that are not successful (after retries)
+    """
+
+    def __init__(self, status_code, message):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+
+
+class DynatraceApiClient:
+    """
+    Client for the Dynatrace API of one environment
+
+    Holds a pooled keep-alive session, so connections (and TLS sessions) are reused across
+    pages, parallel queries and collection cycles. The API token is sent as header instead
+    of a query parameter and responses are requested gzip compressed. All requests go
+    through a RequestScheduler, which retries transient errors and backs off on throttling.
+    With a CassetteRecorder, the final response of every request is recorded.
+    """
+
+    def __init__(self, environment_url, api_token, verify_ssl = True, pool_size = 4, logger = None, request_budget = None, recorder = None):
+        self.environment_url = environment_url
+        self.verify_ssl = verify_ssl
+        self.recorder = recorder
+        self.scheduler = RequestScheduler(pool_size, logger=logger, budget=request_budget)
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Api-Token {api_token}",
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip"
+        })
+
+    def get(self, path, params):
+        """
+        Sends a GET request to the given API path and returns the decoded JSON response
+
+        Raises DynatraceApiError if the request did not succeed after retries. Successful
+        responses are recorded for the instrumentation phase of the calling thread.
+        """
+        url = self.environment_url.rstrip("/") + path
+        attempts = 0
+        started = time.perf_counter()
+
+        def request():
+            nonlocal attempts
+            attempts += 1
+            return self.session.get(url, params=params, verify=self.verify_ssl, timeout=REQUEST_TIMEOUT)
+
+        response = self.scheduler.send(request)
+
+        if self.recorder is not None:
+            self.recorder.record(path, params, response, time.perf_counter() - started)
+
+        if response.status_code != 200:
+            try:
+                message = response.json()["error"]["message"]
+            except (ValueError, KeyError, TypeError):
+                message = response.text[:200]
+            raise DynatraceApiError(response.status_code, message)
+
+        # Content-Length is the compressed size for gzip responses
+        record_request(attempts, int(response.headers.get("Content-Length") or len(response.content)))
+
+        return response.json()
+
+    def paginate(self, path, params):
+        """
+        Yields all pages of a paginated API query
+
+        Follow-up pages are requested only with their nextPageKey as required by the API.
+        """
+        while(True):
+            json = self.get(path, params)
+            yield json
+
+            next_page_key = json.get("nextPageKey")
+            if not next_page_key:
+                break
+            params = { "nextPageKey": next_page_key }
+
+    def iter_entities(self, entity_selector, fields = None, time_from = "now-24h", time_to = None, page_size = ENTITIES_PAGE_SIZE):
+        """
+        Yields the entities of each page matching the given entity selector
+
+        Only entityId, displayName and type are returned unless additional fields
+        (e.g. "+fromRelationships.isAccessibleBy") are requested.
+        """
+        params = {
+            "pageSize": page_size,
+            "entitySelector": entity_selector,
+            "from": time_from
+        }
+        if fields:
+            params["fields"] = fields
+        if time_to:
+            params["to"] = time_to
+
+        for json in self.paginate(MONITORED_ENTITIES_PATH, params):
+            yield json["entities"]
+
+    def iter_metric_data(self, metric_selector, time_from, time_to):
+        """
+        Yields the data series of each page of the first metric matching the given metric selector
+        """
+        params = {
+            "metricSelector": metric_selector,
+            "from": time_from,
+            "to": time_to,
+            "pageSize": METRICS_PAGE_SIZE
+        }
+
+        for json in self.paginate(METRICS_QUERY_PATH, params):
+            yield json["result"][0]["data"]
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,250 @@
+import argparse, csv, json, logging, os, sys, threading
+from datetime import datetime, timedelta, timezone
+
+from .api_client import DynatraceApiClient
+from .collection import DEFAULT_MAX_CONCURRENT_REQUESTS, CollectionEngine, ConsumptionCollector
+from .consumption_store import ConsumptionStore
+from .entity_index import EntityIndex
+from .metadata_cache import MetadataCache
+from .topology_index import TopologyIndex
+
+# Default length of the time buckets the range is split into
+DEFAULT_BUCKET_HOURS = 24
+
+# Default number of buckets collected at once
+DEFAULT_CONCURRENT_BUCKETS = 4
+
+# Entity metadata is reused for all buckets of one backfill
+BACKFILL_METADATA_CACHE_TTL_SECONDS = 7*24*3600
+
+OUTPUT_FORMATS = ["csv", "jsonl"]
+ENTITY_FIELDS = ["time_from", "time_to", "entity_id", "entity_name", "entity_type", "subscription_id", "subscription_name", "ddus"]
+SUBSCRIPTION_FIELDS = ["time_from", "time_to", "subscription_id", "subscription_name", "ddus"]
+
+
+class BackfillWriter:
+    """
+    Appends result rows to a CSV or JSONL file and records which buckets are complete
+
+    After every batch of buckets the file is flushed and the end of the last complete
+    bucket together with the file size is written to a progress file next to the output.
+    A restarted backfill with the same parameters truncates the rows of incomplete
+    buckets and continues after the last complete bucket. An existing output without
+    matching progress is only replaced with overwrite, an output missing since the last
+    progress was recorded starts the backfill over.
+    """
+
+    def __init__(self, path, output_format, fields, parameters, overwrite = False):
+        self.path = path
+        self.output_format = output_format
+        self.fields = fields
+        self.parameters = parameters
+        self.progress_path = path + ".progress.json"
+        self.lock = threading.Lock()
+
+        # End (epoch seconds) of the last complete bucket
+        self.completed_until = None
+        offset = 0
+
+        progress = None if overwrite else self.load_progress()
+        output_size = os.path.getsize(path) if os.path.exists(path) else None
+
+        if progress is not None and output_size is None:
+            # Progress of an output that was removed since, nothing to resume
+            progress = None
+        elif progress is not None:
+            if progress.get("parameters") != parameters:
+                raise ValueError(f"{self.progress_path} belongs to a backfill with other parameters, use --overwrite to start over")
+            if output_size < progress["offset"]:
+                raise ValueError(f"{path} is shorter than recorded in {self.progress_path}, use --overwrite to start over")
+            self.completed_until = progress["completed_until"]
+            offset = progress["offset"]
+        elif output_size is not None and not overwrite:
+            raise ValueError(f"{path} already exists without progress of this backfill, use --overwrite to replace it")
+
+        # Stale progress must not point into the new output if the backfill stops before its first commit
+        if progress is None and os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+        if output_size is not None:
+            os.truncate(path, offset)
+        self.file = open(path, "a", encoding="utf-8", newline="")
+        self.csv_writer = csv.writer(self.file) if output_format == "csv" else None
+
+        if offset == 0 and self.csv_writer is not None:
+            self.csv_writer.writerow(fields)
+
+    def write(self, row):
+        with self.lock:
+            if self.csv_writer is not None:
+                self.csv_writer.writerow([row[field] for field in self.fields])
+            else:
+                self.file.write(json.dumps(row) + "\n")
+
+    def commit(self, completed_until):
+        """
+        Records all buckets up to completed_until (epoch seconds) as complete
+        """
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.completed_until = completed_until
+
+            progress = {"parameters": self.parameters, "completed_until": completed_until, "offset": self.file.tell()}
+            temporary_path = self.progress_path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump(progress, f)
+            os.replace(temporary_path, self.progress_path)
+
+    def load_progress(self):
+        try:
+            with open(self.progress_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def close(self):
+        self.file.close()
+
+
+def split_buckets(start, end, bucket_seconds):
+    """
+    Returns the (start, end) buckets in epoch seconds covering the range, the last one may be shorter
+    """
+    return [(bucket_start, min(bucket_start + bucket_seconds, end)) for bucket_start in range(start, end, bucket_seconds)]
+
+
+def isoformat(epoch_seconds):
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).isoformat(timespec='milliseconds')
+
+
+def run_backfill(logger, api_client, range_start, range_end, bucket_seconds, writer, summarize_by_subscription, max_concurrent_requests = DEFAULT_MAX_CONCURRENT_REQUESTS, concurrent_buckets = DEFAULT_CONCURRENT_BUCKETS):
+    """
+    Collects the DDU consumption of all Azure entities in a past time range bucket by bucket and writes it to writer
+
+    Buckets after the last complete bucket of the writer are collected in batches of
+    concurrent_buckets with the collection logic of the extension: the buckets of a batch
+    are queried concurrently, entities are resolved once and kept for all later batches.
+    Memory is bounded by the entity metadata and the rows of one batch (summarized mode).
+    Returns the number of collected records.
+    """
+    entity_index = EntityIndex()
+    metadata_cache = MetadataCache(BACKFILL_METADATA_CACHE_TTL_SECONDS)
+    engine = CollectionEngine(max_concurrent_requests)
+
+    # The topology of the whole range is loaded once for all batches
+    topology_index = TopologyIndex(max_age_seconds=float("inf"))
+
+    buckets = split_buckets(writer.completed_until or range_start, range_end, bucket_seconds)
+    if writer.completed_until:
+        logger.info(f"Resuming backfill at {isoformat(writer.completed_until)}.")
+
+    record_count = 0
+    for i in range(0, len(buckets), concurrent_buckets):
+        batch = buckets[i:i + concurrent_buckets]
+
+        collector = ConsumptionCollector(logger, api_client, isoformat(batch[0][0]), isoformat(range_end), entity_index, metadata_cache=metadata_cache, entity_time_from=isoformat(range_start), topology_index=topology_index)
+        collector.fetch_subscriptions()
+
+        windows = []
+        stores = []
+        for bucket_start, bucket_end in batch:
+            time_from, time_to = isoformat(bucket_start), isoformat(bucket_end)
+            if summarize_by_subscription:
+                store = ConsumptionStore()
+                stores.append((time_from, time_to, store))
+                windows.append((time_from, time_to, store.add))
+            else:
+                windows.append((time_from, time_to, entity_row_writer(writer, time_from, time_to)))
+
+        record_count += collector.collect_windows(engine, windows)
+
+        for time_from, time_to, store in stores:
+            ddus_by_subscription, _ = store.summarize()
+            for (subscription_id, subscription_name), ddus in ddus_by_subscription:
+                writer.write({"time_from": time_from, "time_to": time_to, "subscription_id": subscription_id, "subscription_name": subscription_name, "ddus": ddus})
+
+        writer.commit(batch[-1][1])
+        logger.info(f"Completed {i + len(batch)} of {len(buckets)} buckets up to {isoformat(batch[-1][1])} ({record_count} records).")
+
+    return record_count
+
+
+def entity_row_writer(writer, time_from, time_to):
+    def write(record):
+        writer.write({
+            "time_from": time_from,
+            "time_to": time_to,
+            "entity_id": record.entity_id,
+            "entity_name": record.entity_name,
+            "entity_type": record.entity_type,
+            "subscription_id": record.subscription_id,
+            "subscription_name": record.subscription_name,
+            "ddus": record.metric_ddus
+        })
+    return write
+
+
+def parse_datetime(value):
+    """
+    Parses an ISO 8601 date or date and time, without time zone in UTC
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def main(argv = None):
+    """
+    Command line entry point: python -m azure_ddu_monitoring backfill --help
+    """
+    parser = argparse.ArgumentParser(prog="python -m azure_ddu_monitoring backfill", description="Writes the DDU consumption of Azure entities in a past time range to a CSV or JSONL file")
+    parser.add_argument("--environment-url", required=True, help="Managed: https://{your-domain}/e/{your-environment-id} | SaaS: https://{your-environment-id}.live.dynatrace.com")
+    parser.add_argument("--api-token", default=os.environ.get("DT_API_TOKEN"), help="API token with \"Read entities\" and \"Read metrics\" permissions (default: $DT_API_TOKEN)")
+    parser.add_argument("--from", dest="time_from", required=True, type=parse_datetime, help="start of the range, e.g. 2024-05-01 (UTC unless given)")
+    parser.add_argument("--to", dest="time_to", required=True, type=parse_datetime, help="end of the range (exclusive)")
+    parser.add_argument("--output", required=True, help="CSV or JSONL file, resumed if a progress file of the same backfill exists")
+    parser.add_argument("--overwrite", action="store_true", help="replace an existing output instead of refusing to start (or resuming)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="output format (default: from the file extension)")
+    parser.add_argument("--bucket-hours", type=float, default=DEFAULT_BUCKET_HOURS)
+    parser.add_argument("--concurrent-buckets", type=int, default=DEFAULT_CONCURRENT_BUCKETS)
+    parser.add_argument("--max-concurrent-requests", type=int, default=DEFAULT_MAX_CONCURRENT_REQUESTS)
+    parser.add_argument("--summarize-by-subscription", action="store_true")
+    parser.add_argument("--no-verify-ssl", dest="verify_ssl", action="store_false")
+    args = parser.parse_args(argv)
+
+    if not args.api_token:
+        parser.error("an API token is required (--api-token or $DT_API_TOKEN)")
+    if args.time_from >= args.time_to:
+        parser.error("--from has to be before --to")
+
+    output_format = args.format or ("jsonl" if args.output.endswith((".jsonl", ".json")) else "csv")
+    bucket_seconds = max(60, int(timedelta(hours=args.bucket_hours).total_seconds()))
+    range_start, range_end = int(args.time_from.timestamp()), int(args.time_to.timestamp())
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", stream=sys.stderr)
+    logger = logging.getLogger("azure_ddu_monitoring.backfill")
+
+    parameters = {
+        "environment_url": args.environment_url,
+        "from": range_start,
+        "to": range_end,
+        "bucket_seconds": bucket_seconds,
+        "summarize_by_subscription": args.summarize_by_subscription,
+        "format": output_format
+    }
+    fields = SUBSCRIPTION_FIELDS if args.summarize_by_subscription else ENTITY_FIELDS
+    try:
+        writer = BackfillWriter(args.output, output_format, fields, parameters, args.overwrite)
+    except ValueError as e:
+        parser.error(str(e))
+
+    api_client = DynatraceApiClient(args.environment_url, args.api_token, args.verify_ssl, args.max_concurrent_requests, logger)
+
+    try:
+        record_count = run_backfill(logger, api_client, range_start, range_end, bucket_seconds, writer, args.summarize_by_subscription, args.max_concurrent_requests, max(1, args.concurrent_buckets))
+        logger.info(f"Backfill finished with {record_count} records in {args.output}.")
+    finally:
+        writer.close()
+        api_client.close()
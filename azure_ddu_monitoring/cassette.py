@@ -0,0 +1,191 @@
+import gzip, json, os, re, threading, time
+from collections import deque
+from datetime import datetime, timezone
+from hashlib import sha256
+
+import requests
+
+from .metadata_cache import METADATA_CACHE_DIRECTORY
+
+# Format version of cassette files
+CASSETTE_VERSION = 1
+
+# Latency modes of replayed responses
+LATENCY_ORIGINAL = "original"
+LATENCY_ZERO = "zero"
+
+
+# Entity IDs of an entityId(...) selector
+ENTITY_ID_SELECTOR_PATTERN = re.compile(r'^entityId\((.*)\)$')
+ENTITY_ID_PATTERN = re.compile(r'"([^"]+)"')
+
+
+def request_key(path, params):
+    return path + "?" + json.dumps(params, sort_keys=True)
+
+
+def selected_entity_ids(params):
+    """
+    Returns the entity IDs of an entityId(...) selector in the params, None for other requests
+    """
+    match = ENTITY_ID_SELECTOR_PATTERN.match(params.get("entitySelector", ""))
+    return ENTITY_ID_PATTERN.findall(match.group(1)) if match else None
+
+
+def entity_lookup_key(path, params):
+    return request_key(path, {name: value for name, value in params.items() if name not in ("entitySelector", "pageSize")})
+
+
+class CassetteRecorder:
+    """
+    Records the API responses of one collection cycle to a gzip compressed cassette file
+
+    The first line of the cassette is a header with the parameters of the recorded cycle,
+    every further line one response: the API path, query parameters, status code, time
+    until the response was received (including retries) and the response body. Responses
+    are written while the cycle runs, so recording needs no memory for them.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.lock = threading.Lock()
+        self.response_count = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.write(dict(header, version=CASSETTE_VERSION))
+
+    @staticmethod
+    def default_path(name):
+        """
+        Returns a new cassette file of the given endpoint
+        """
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        return os.path.join(METADATA_CACHE_DIRECTORY, f"cassette_{sha256(name.encode()).hexdigest()[:16]}_{timestamp}.jsonl.gz")
+
+    def record(self, path, params, response, elapsed):
+        self.write({
+            "path": path,
+            "params": params,
+            "status": response.status_code,
+            "elapsed": round(elapsed, 6),
+            "body": response.text
+        })
+        with self.lock:
+            self.response_count += 1
+
+    def write(self, entry):
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class Cassette:
+    """
+    Recorded API responses by request, loaded from a cassette file
+
+    Which entities are resolved together in one entityId(...) request depends on which
+    page of metric results (of concurrent time windows) is resolved first, so a replay may
+    group them differently than the recording. Entity requests by ID which were not
+    recorded as such are therefore answered with the recorded entities of these IDs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Recorded responses in order by request key
+        self.responses = {}
+
+        # Recorded entities and the time their response took by entity ID, by request key without selector
+        self.entities_by_id = {}
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            self.header = json.loads(f.readline())
+            if self.header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version {self.header.get('version')} of {path}")
+
+            for line in f:
+                entry = json.loads(line)
+                self.responses.setdefault(request_key(entry["path"], entry["params"]), deque()).append(entry)
+
+                if entry["status"] == 200 and selected_entity_ids(entry["params"]) is not None:
+                    entities_by_id = self.entities_by_id.setdefault(entity_lookup_key(entry["path"], entry["params"]), {})
+                    for entity in json.loads(entry["body"]).get("entities", []):
+                        entities_by_id[entity["entityId"]] = (entity, entry["elapsed"])
+
+    def next_response(self, path, params):
+        """
+        Returns the next recorded response of the given request, repeating the last one, or None if it was not recorded
+        """
+        responses = self.responses.get(request_key(path, params))
+        if not responses:
+            return self.entities_response(path, params)
+        return responses.popleft() if len(responses) > 1 else responses[0]
+
+    def entities_response(self, path, params):
+        """
+        Returns a response of the recorded entities of an entityId(...) request, or None for other requests
+
+        IDs that were never recorded are left out like the API leaves out unknown entities.
+        The response takes as long as the slowest recorded response of its entities.
+        """
+        entity_ids = selected_entity_ids(params)
+        entities_by_id = self.entities_by_id.get(entity_lookup_key(path, params))
+        if entity_ids is None or entities_by_id is None:
+            return None
+
+        recorded = [entities_by_id[entity_id] for entity_id in entity_ids if entity_id in entities_by_id]
+        entities = [entity for entity, _ in recorded]
+        return {
+            "path": path,
+            "params": params,
+            "status": 200,
+            "elapsed": max((elapsed for _, elapsed in recorded), default=0.0),
+            "body": json.dumps({"totalCount": len(entities), "pageSize": params.get("pageSize"), "entities": entities})
+        }
+
+    def __len__(self):
+        return sum(len(responses) for responses in self.responses.values())
+
+
+class ReplaySession:
+    """
+    Stand-in for the requests session of a DynatraceApiClient answering requests from a cassette
+
+    With latency LATENCY_ORIGINAL every response is delayed by the time it took when it was
+    recorded, with LATENCY_ZERO it is returned at once. Requests missing in the cassette
+    get a 404 response.
+    """
+
+    def __init__(self, cassette, environment_url, latency = LATENCY_ORIGINAL):
+        self.cassette = cassette
+        self.environment_url = environment_url.rstrip("/")
+        self.latency = latency
+
+    def get(self, url, params = None, **kwargs):
+        path = url[len(self.environment_url):] if url.startswith(self.environment_url) else url
+        entry = self.cassette.next_response(path, params or {})
+
+        response = requests.Response()
+        response.url = url
+        response.encoding = "utf-8"
+
+        if entry is None:
+            response.status_code = 404
+            response._content = json.dumps({"error": {"code": 404, "message": f"Request not recorded in cassette: {path}"}}).encode("utf-8")
+            return response
+
+        if self.latency == LATENCY_ORIGINAL:
+            time.sleep(entry["elapsed"])
+
+        response.status_code = entry["status"]
+        response._content = entry["body"].encode("utf-8")
+        response.headers["Content-Length"] = str(len(response._content))
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,378 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .instrumentation import Instrumentation
+from .query_planner import CUSTOM_DEVICE, QueryPlanner
+
+# List of Azure Classic entity types relevant for consumption reporting
+CLASSIC_TYPES = [
+    "AZURE_API_MANAGEMENT_SERVICE",
+    "AZURE_REDIS_CACHE",
+    "AZURE_VM",
+    "AZURE_VM_SCALE_SET",
+    "AZURE_IOT_HUB",
+    "AZURE_COSMOS_DB",
+    "AZURE_EVENT_HUB_NAMESPACE",
+    "AZURE_EVENT_HUB",
+    "AZURE_APPLICATION_GATEWAY",
+    "AZURE_LOAD_BALANCER",
+    "AZURE_SERVICE_BUS_NAMESPACE",
+    "AZURE_SERVICE_BUS_TOPIC",
+    "AZURE_SERVICE_BUS_QUEUE",
+    "AZURE_SQL_SERVER",
+    "AZURE_SQL_DATABASE",
+    "AZURE_SQL_ELASTIC_POOL",
+    "AZURE_STORAGE_ACCOUNT"
+]
+
+# Default number of queries running in parallel per endpoint
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+
+# Maximum number of entity IDs per entityId(...) selector
+ENTITY_ID_CHUNK_SIZE = 100
+
+
+# Class for mapping DDU consumption to Azure entities and their Azure subscriptions
+class ConsumptionRecord:
+
+    # Constructor function
+    def __init__(self,
+                entity_id = "Undefined",
+                entity_name = "Undefined",
+                entity_type = "Undefined",
+                subscription_id = "Undefined",
+                subscription_name = "Undefined",
+                metric_ddus = 0):
+
+        self.entity_id = entity_id
+        self.entity_name = entity_name
+        self.entity_type = entity_type
+        self.subscription_id = subscription_id
+        self.subscription_name = subscription_name
+        self.metric_ddus = metric_ddus
+
+
+class CollectionEngine:
+    """
+    Runs collection tasks on a bounded thread pool
+
+    Results are returned in the order the tasks were given, independent of the order
+    in which they complete, so merging them stays deterministic.
+    """
+
+    def __init__(self, max_workers = DEFAULT_MAX_CONCURRENT_REQUESTS):
+        self.max_workers = max(1, max_workers)
+
+    def run(self, tasks):
+        """
+        Runs a list of (function, args) tuples and returns their results in the same order
+
+        The first exception raised by a task is re-raised once all tasks are finished.
+        """
+        if self.max_workers == 1 or len(tasks) <= 1:
+            return [function(*args) for function, args in tasks]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tasks)), thread_name_prefix="azure_ddu_collection") as executor:
+            futures = [executor.submit(function, *args) for function, args in tasks]
+            return [future.result() for future in futures]
+
+
+class ConsumptionCollector:
+    """
+    Collects DDU consumption of Azure entities for one Dynatrace environment and time frame
+
+    The fetch_* and collect_query methods only read shared state (besides adding entities
+    to the entity index and metadata cache) and can therefore run in parallel on a
+    CollectionEngine.
+
+    Only consuming entities are resolved: Cloud Azure entities by listing them per
+    subscription, Classic entities by their IDs. With a topology index, subscriptions and
+    the subscriptions of all entities are taken from it instead, and only entities missing
+    in it are fetched by their IDs. With a metadata cache, subscriptions and entities are
+    taken from the cache and only entities missing in it are fetched.
+
+    Every fetch and processing step runs in a phase of the given Instrumentation.
+
+    Entities are looked up among the entities existing between entity_time_from and
+    time_to, which has to cover the whole time frame when collecting past windows.
+    """
+
+    def __init__(self, logger, api_client, time_from, time_to, entity_index, query_planner = None, metadata_cache = None, instrumentation = None, entity_time_from = "now-24h", topology_index = None):
+        self.logger = logger
+        self.api_client = api_client
+        self.time_from = time_from
+        self.time_to = time_to
+        self.entity_time_from = entity_time_from
+        self.entity_index = entity_index
+        self.query_planner = query_planner or QueryPlanner()
+        self.metadata_cache = metadata_cache
+        self.topology_index = topology_index
+        self.instrumentation = instrumentation or Instrumentation()
+
+    def fetch_subscriptions(self, use_cache = True):
+        """
+        Fetches all Azure Subscription entities into the entity index
+
+        With a topology index, the subscriptions are taken from it (loading it if it is
+        not fresh anymore).
+        """
+        if use_cache and self.topology_index is not None:
+            with self.instrumentation.phase("topology"):
+                if self.topology_index.refresh(self.api_client, self.entity_time_from, self.time_to, self.instrumentation):
+                    self.logger.info(f"Loaded topology of {len(self.topology_index)} Azure entities in {len(self.topology_index.subscriptions)} Azure Subscriptions.")
+                self.entity_index.subscriptions.update(self.topology_index.subscriptions)
+            return
+
+        with self.instrumentation.phase("subscriptions"):
+            if use_cache and self.metadata_cache is not None:
+                subscriptions = self.metadata_cache.get_subscriptions()
+                if subscriptions is not None:
+                    self.entity_index.subscriptions.update(subscriptions)
+                    self.instrumentation.add_entities(len(subscriptions))
+                    self.logger.info(f"Using {len(subscriptions)} cached Azure Subscriptions.")
+                    return
+
+            for subscription_entities in self.api_client.iter_entities("type(AZURE_SUBSCRIPTION)", "+properties.azureSubscriptionUuid", time_from=self.entity_time_from, time_to=self.time_to):
+                self.entity_index.add_subscriptions(subscription_entities)
+                self.instrumentation.add_entities(len(subscription_entities))
+
+        if self.metadata_cache is not None:
+            self.metadata_cache.put_subscriptions(self.entity_index.subscriptions)
+
+        self.logger.info(f"Fetched {len(self.entity_index.subscriptions)} Azure Subscriptions.")
+
+    def collect(self, engine, on_record):
+        """
+        Streams consumption records of Cloud and Classic Azure entities of all subscriptions to on_record
+
+        Metric results are processed page by page: the entities of a page are resolved,
+        joined and handed over before the next page is requested, so no list of all metric
+        rows or records of the cycle is built up. Whatever on_record keeps (e.g. the metric
+        lines buffered by the extension SDK) is not bounded by this. Returns the number of
+        collected records.
+        """
+        return self.collect_windows(engine, [(self.time_from, self.time_to, on_record)])
+
+    def collect_windows(self, engine, windows):
+        """
+        Streams consumption records of several (time_from, time_to, on_record) time windows in one pass
+
+        Every metric query of every window runs as a task of its own, so windows are
+        queried concurrently. Subscriptions and entities are resolved once for all windows:
+        pages are resolved one at a time, so a target showing up in several windows at
+        once is still listed only once. Returns the number of collected records.
+        """
+        self.engine = engine
+
+        # Targets whose entities were fully listed during this cycle (only CUSTOM_DEVICE)
+        self.listed_targets = set()
+        self.subscriptions_refreshed = False
+        self.resolution_lock = threading.Lock()
+
+        # Fetch billed DDUs of all targets with as few bulk metric queries as possible
+        # ================================================================================================
+        queries = self.query_planner.plan([CUSTOM_DEVICE] + CLASSIC_TYPES)
+        self.logger.info(f"Collecting consumption of {len(windows)} time windows with {len(queries)} metric queries each.")
+
+        tasks = [(self.collect_query, (query, time_from, time_to, on_record)) for time_from, time_to, on_record in windows for query in queries]
+
+        record_counts = {}
+        for query_record_counts in engine.run(tasks):
+            for target, record_count in query_record_counts.items():
+                record_counts[target] = record_counts.get(target, 0) + record_count
+
+        for target, record_count in record_counts.items():
+            if record_count > 0:
+                self.logger.info(f"Fetched consumption for {record_count} Azure entities of type {target}.")
+
+        if self.metadata_cache is not None:
+            for target in self.listed_targets:
+                self.metadata_cache.mark_listed(target)
+
+        return sum(record_counts.values())
+
+    def collect_query(self, query, time_from, time_to, on_record):
+        """
+        Streams the consumption records of one metric query and time window to on_record
+
+        Returns the number of records by target.
+        """
+        record_counts = {target: 0 for target in query.targets}
+
+        with self.instrumentation.phase("consumption_query"):
+            for metric_data in self.api_client.iter_metric_data(query.metric_selector, time_from, time_to):
+
+                # Route result rows of the page to their target
+                consumption_by_target = {}
+                for metric_consumption in metric_data:
+                    target = self.query_planner.route(metric_consumption["dimensionMap"]["dt.entity.monitored_entity"])
+                    if target in record_counts:
+                        consumption_by_target.setdefault(target, []).append(metric_consumption)
+
+                with self.instrumentation.phase("entity_resolution"), self.resolution_lock:
+                    self.resolve_entities(consumption_by_target)
+
+                # Create consumption records per Azure entity
+                with self.instrumentation.phase("join"):
+                    records = []
+                    for target, metric_consumption_list in consumption_by_target.items():
+                        for metric_consumption in metric_consumption_list:
+                            records.append(self.create_record(metric_consumption, target))
+                        record_counts[target] += len(metric_consumption_list)
+
+                with self.instrumentation.phase("encoding"):
+                    for record in records:
+                        on_record(record)
+
+            self.instrumentation.add_entities(sum(record_counts.values()))
+
+        return record_counts
+
+    def resolve_entities(self, consumption_by_target):
+        """
+        Makes sure the entities of one page of metric results are in the entity index
+
+        With a topology index, entities are joined with it and only entities missing in it
+        are resolved by their IDs. Otherwise Cloud Azure entities (CUSTOM_DEVICE) are listed
+        per subscription once per cycle unless they were listed recently. Classic entities,
+        and Cloud Azure entities while their listing is fresh, are resolved only by the IDs
+        of the consuming entities: from the metadata cache if possible, otherwise with
+        chunked entityId(...) queries running in parallel. Entity API traffic therefore grows with the number of
+        consuming entities instead of the whole inventory.
+        """
+        tasks = []
+
+        for target, metric_consumption_list in consumption_by_target.items():
+            if target in self.listed_targets:
+                continue
+
+            if target == CUSTOM_DEVICE and self.topology_index is None and not (self.metadata_cache is not None and self.metadata_cache.is_listed(target)):
+                tasks += [(self.fetch_subscription_entities, (subscription_entity_id,)) for subscription_entity_id in list(self.entity_index.subscriptions)]
+                self.listed_targets.add(target)
+                continue
+
+            if self.topology_index is not None:
+                entity_ids = self.apply_topology(metric_consumption_list)
+            else:
+                entity_ids = [metric_consumption["dimensionMap"]["dt.entity.monitored_entity"] for metric_consumption in metric_consumption_list]
+                entity_ids = [entity_id for entity_id in entity_ids if self.entity_index.get(entity_id) is None]
+            if self.metadata_cache is not None:
+                entity_ids = self.apply_cached_entities(entity_ids)
+
+            for i in range(0, len(entity_ids), ENTITY_ID_CHUNK_SIZE):
+                tasks.append((self.fetch_entities_by_id, (entity_ids[i:i + ENTITY_ID_CHUNK_SIZE], target)))
+
+        self.engine.run(tasks)
+
+        # Entities may belong to subscriptions created after the cached (or indexed) subscriptions were fetched
+        if (self.metadata_cache is not None or self.topology_index is not None) and not self.subscriptions_refreshed:
+            if any(self.entity_index.subscription_of(entity_id) is None and entity_id in self.entity_index.entity_subscriptions for entity_id in self.iter_entity_ids(consumption_by_target)):
+                self.subscriptions_refreshed = True
+                self.fetch_subscriptions(use_cache=False)
+
+    @staticmethod
+    def iter_entity_ids(consumption_by_target):
+        for metric_consumption_list in consumption_by_target.values():
+            for metric_consumption in metric_consumption_list:
+                yield metric_consumption["dimensionMap"]["dt.entity.monitored_entity"]
+
+    def fetch_subscription_entities(self, subscription_entity_id):
+        """
+        Fetches Cloud Azure entities (CUSTOM_DEVICE) of the given Azure subscription into the entity index
+        """
+        subscription_id = self.entity_index.subscriptions[subscription_entity_id]["subscription_id"]
+
+        azure_entity_count = 0
+        entity_selector = f"type(CUSTOM_DEVICE),fromRelationships.belongsTo(type(AZURE_SUBSCRIPTION),azureSubscriptionUuid({subscription_id}))"
+        with self.instrumentation.phase("custom_device_collection"):
+            for azure_entities in self.api_client.iter_entities(entity_selector, time_from=self.entity_time_from, time_to=self.time_to):
+                self.add_entities(azure_entities, subscription_entity_id)
+                azure_entity_count += len(azure_entities)
+            self.instrumentation.add_entities(azure_entity_count)
+
+        self.logger.info(f"Fetched {azure_entity_count} Cloud Azure entities of subscription {subscription_id}.")
+
+    def fetch_entities_by_id(self, entity_ids, target):
+        """
+        Fetches the given entities of one target with their Azure subscription into the entity index
+        """
+        entity_selector = "entityId(" + ",".join(f"\"{entity_id}\"" for entity_id in entity_ids) + ")"
+        fields = "+fromRelationships.isAccessibleBy,+fromRelationships.belongsTo"
+        phase = "entity_resolution" if target == CUSTOM_DEVICE else "classic_collection"
+        with self.instrumentation.phase(phase, **{"entity.type": target}):
+            for entities in self.api_client.iter_entities(entity_selector, fields, time_from=self.entity_time_from, time_to=self.time_to):
+                self.add_entities(entities)
+            self.instrumentation.add_entities(len(entity_ids))
+
+        self.logger.info(f"Fetched {len(entity_ids)} consuming entities of type {target} by ID.")
+
+    def add_entities(self, entities, subscription_entity_id = None):
+        """
+        Adds fetched entities to the entity index and the metadata cache
+        """
+        self.entity_index.add_entities(entities, subscription_entity_id)
+
+        if self.metadata_cache is not None:
+            for entity in entities:
+                entity_id = entity["entityId"]
+                metadata = self.entity_index.get(entity_id)
+                self.metadata_cache.put(entity_id, metadata["entity_name"], metadata["entity_type"], self.entity_index.entity_subscriptions.get(entity_id))
+
+    def apply_topology(self, metric_consumption_list):
+        """
+        Adds entities of the topology index to the entity index and returns the IDs of unknown entities missing in it
+
+        Entity names are taken from the metric result rows.
+        """
+        missing_entity_ids = []
+        for metric_consumption in metric_consumption_list:
+            dimension_map = metric_consumption["dimensionMap"]
+            entity_id = dimension_map["dt.entity.monitored_entity"]
+            if self.entity_index.get(entity_id) is not None:
+                continue
+
+            entry = self.topology_index.get(entity_id)
+            if entry is None:
+                missing_entity_ids.append(entity_id)
+            else:
+                entity_type, subscription_entity_id = entry
+                self.entity_index.add_entity(entity_id, dimension_map.get("dt.entity.monitored_entity.name", "Undefined"), entity_type, subscription_entity_id)
+
+        return missing_entity_ids
+
+    def apply_cached_entities(self, entity_ids):
+        """
+        Adds cached entities to the entity index and returns the IDs of entities missing in the cache
+        """
+        missing_entity_ids = []
+        for entity_id in entity_ids:
+            entry = self.metadata_cache.get(entity_id)
+            if entry is None:
+                missing_entity_ids.append(entity_id)
+            else:
+                self.entity_index.add_entity(entity_id, entry["entity_name"], entry["entity_type"], entry["subscription_entity_id"])
+
+        return missing_entity_ids
+
+    def create_record(self, metric_consumption, target):
+        """
+        Creates the consumption record of one metric result row joined with the entity index
+        """
+        entity_id = metric_consumption["dimensionMap"]["dt.entity.monitored_entity"]
+        entity_name = metric_consumption["dimensionMap"].get("dt.entity.monitored_entity.name", "Undefined")
+        entity_type = target # e.g. AZURE_WEB_APP for AZURE_WEB_APP-F0991A85FA6C2703
+        metric_ddus = metric_consumption["values"][0]
+
+        entity = self.entity_index.get(entity_id)
+        if (entity is not None):
+            entity_name = entity["entity_name"]
+            entity_type = entity["entity_type"]
+
+        subscription_id = subscription_name = "Undefined"
+
+        subscription = self.entity_index.subscription_of(entity_id)
+        if (subscription is not None):
+            subscription_id = subscription["subscription_id"]
+            subscription_name = subscription["subscription_name"]
+
+        return ConsumptionRecord(entity_id, entity_name, entity_type, subscription_id, subscription_name, metric_ddus)
@@ -0,0 +1,77 @@
+import threading
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ConsumptionStore:
+    """
+    Columnar store of the consumption records of one time window for summarized reporting
+
+    Every record is kept as one row of three columns: the code of its Azure subscription,
+    the code of its entity type and its billed DDUs. Subscriptions and entity types are
+    interned into tables once and rows only hold their codes in typed arrays, so a row
+    takes 16 bytes instead of a record object. All summaries are computed at once from
+    the columns, vectorized with NumPy if it is installed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # Interned (subscription_id, subscription_name) pairs and entity types, by code
+        self.subscriptions = []
+        self.subscription_codes = {}
+        self.entity_types = []
+        self.entity_type_codes = {}
+
+        # Columns
+        self.subscription_column = array("I")
+        self.entity_type_column = array("I")
+        self.ddus_column = array("d")
+
+    def add(self, record):
+        subscription = (record.subscription_id, record.subscription_name)
+
+        with self.lock:
+            subscription_code = self.subscription_codes.get(subscription)
+            if subscription_code is None:
+                subscription_code = self.subscription_codes[subscription] = len(self.subscriptions)
+                self.subscriptions.append(subscription)
+
+            entity_type_code = self.entity_type_codes.get(record.entity_type)
+            if entity_type_code is None:
+                entity_type_code = self.entity_type_codes[record.entity_type] = len(self.entity_types)
+                self.entity_types.append(record.entity_type)
+
+            self.subscription_column.append(subscription_code)
+            self.entity_type_column.append(entity_type_code)
+            self.ddus_column.append(record.metric_ddus)
+
+    def summarize(self):
+        """
+        Returns the summed DDUs by subscription and by entity type
+
+        Both are lists of ((subscription_id, subscription_name), ddus) and (entity_type, ddus)
+        in the order the subscriptions and entity types were first added.
+        """
+        with self.lock:
+            ddus_by_subscription = self.sum_by(self.subscription_column, len(self.subscriptions))
+            ddus_by_entity_type = self.sum_by(self.entity_type_column, len(self.entity_types))
+            return list(zip(self.subscriptions, ddus_by_subscription)), list(zip(self.entity_types, ddus_by_entity_type))
+
+    def sum_by(self, code_column, code_count):
+        if numpy is not None:
+            codes = numpy.frombuffer(code_column, dtype=numpy.uint32)
+            ddus = numpy.frombuffer(self.ddus_column, dtype=numpy.float64)
+            return numpy.bincount(codes, weights=ddus, minlength=code_count).tolist()
+
+        sums = [0.0] * code_count
+        for code, ddus in zip(code_column, self.ddus_column):
+            sums[code] += ddus
+        return sums
+
+    def __len__(self):
+        return len(self.ddus_column)
@@ -0,0 +1,84 @@
+class EntityIndex:
+    """
+    Hashed index of Azure entities and their Azure subscriptions
+
+    Entities are added page by page while the entities API is paginated, so joining
+    consumption rows against the index is a constant time lookup per row instead of
+    a scan over all fetched entities.
+    """
+
+    def __init__(self):
+
+        # Azure Subscriptions by subscription entity ID, e.g. AZURE_SUBSCRIPTION-0F32A5C8D9B1E7F4
+        self.subscriptions = {}
+
+        # Entity name and type by entity ID
+        self.entities = {}
+
+        # Subscription entity ID by entity ID
+        self.entity_subscriptions = {}
+
+    def add_subscriptions(self, subscription_entities):
+        """
+        Adds AZURE_SUBSCRIPTION entities fetched with "+properties"
+        """
+        for subscription_entity in subscription_entities:
+            self.subscriptions[subscription_entity["entityId"]] = {
+                "subscription_id": subscription_entity["properties"]["azureSubscriptionUuid"],
+                "subscription_name": subscription_entity["displayName"]
+            }
+
+    def add_entities(self, entities, subscription_entity_id = None):
+        """
+        Adds entities of one page of the entities API
+
+        If no subscription entity ID is given, the subscription is taken from the
+        "isAccessibleBy" (Classic) or "belongsTo" (CUSTOM_DEVICE) relationship of the
+        entity (if it was requested).
+        """
+        for entity in entities:
+            entity_id = entity["entityId"]
+
+            self.entities[entity_id] = {
+                "entity_name": entity.get("displayName", "Undefined"),
+                "entity_type": entity.get("type", "Undefined")
+            }
+
+            if subscription_entity_id is not None:
+                self.entity_subscriptions[entity_id] = subscription_entity_id
+                continue
+
+            from_relationships = entity.get("fromRelationships", {})
+            for related_entity in from_relationships.get("isAccessibleBy", []) + from_relationships.get("belongsTo", []):
+                if related_entity["type"] == "AZURE_SUBSCRIPTION":
+                    self.entity_subscriptions[entity_id] = related_entity["id"]
+                    break
+
+    def add_entity(self, entity_id, entity_name, entity_type, subscription_entity_id = None):
+        """
+        Adds a single entity, e.g. from the metadata cache
+        """
+        self.entities[entity_id] = {
+            "entity_name": entity_name,
+            "entity_type": entity_type
+        }
+        if subscription_entity_id is not None:
+            self.entity_subscriptions[entity_id] = subscription_entity_id
+
+    def get(self, entity_id):
+        """
+        Returns name and type of the given entity or None if the entity is unknown
+        """
+        return self.entities.get(entity_id)
+
+    def subscription_of(self, entity_id):
+        """
+        Returns ID and name of the Azure subscription of the given entity or None if unknown
+        """
+        subscription_entity_id = self.entity_subscriptions.get(entity_id)
+        if subscription_entity_id is None:
+            return None
+        return self.subscriptions.get(subscription_entity_id)
+
+    def __len__(self):
+        return len(self.entities)
@@ -0,0 +1,115 @@
+import threading, time
+from contextlib import contextmanager
+
+from .mint_encoder import escape_dimension_value
+
+# Metric key prefix of self-monitoring metrics
+SELFMON_METRIC_PREFIX = "consumption.ddu.metrics.azure.selfmon"
+
+# Statistics recorded per phase, "duration" in seconds
+FIELDS = ("duration", "requests", "pages", "bytes_received", "retries", "entities")
+
+# Stack of active phases of the current thread
+_context = threading.local()
+
+
+class _Frame:
+
+    def __init__(self, instrumentation, key, started):
+        self.instrumentation = instrumentation
+        self.key = key
+        self.started = started
+
+
+def _stack():
+    if not hasattr(_context, "stack"):
+        _context.stack = []
+    return _context.stack
+
+
+class Instrumentation:
+    """
+    Per-phase statistics of one collection cycle
+
+    Phases are entered with the phase() context manager and may be nested; durations are
+    exclusive (time spent in a nested phase only counts for the nested phase) and summed up
+    over all threads. Requests sent by the API client are attributed to the innermost phase
+    of the sending thread. An optional profiler (see replay.PhaseProfiler) is notified
+    whenever a phase is entered or left.
+    """
+
+    def __init__(self, profiler = None):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.profiler = profiler
+
+        # Statistics by (phase, dimensions)
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name, **dimensions):
+        key = (name, tuple(sorted(dimensions.items())))
+        stack = _stack()
+
+        now = time.perf_counter()
+        if stack:
+            parent = stack[-1]
+            parent.instrumentation.add(parent.key, duration=now - parent.started)
+
+        frame = _Frame(self, key, now)
+        stack.append(frame)
+        if self.profiler is not None:
+            self.profiler.enter(name)
+        try:
+            yield
+        finally:
+            if self.profiler is not None:
+                self.profiler.exit(name)
+            now = time.perf_counter()
+            stack.pop()
+            self.add(key, duration=now - frame.started)
+            if stack:
+                stack[-1].started = now
+
+    def add(self, key, **values):
+        with self.lock:
+            statistics = self.phases.get(key)
+            if statistics is None:
+                statistics = self.phases[key] = dict.fromkeys(FIELDS, 0)
+            for field, value in values.items():
+                statistics[field] += value
+
+    def add_entities(self, count):
+        """
+        Adds fetched or collected entities to the current phase of the calling thread
+        """
+        stack = _stack()
+        if stack and stack[-1].instrumentation is self:
+            self.add(stack[-1].key, entities=count)
+
+    def metric_lines(self, environment_url):
+        """
+        Returns the statistics of all phases and the total cycle duration as metric lines
+        """
+        environment_url = escape_dimension_value(environment_url)
+        lines = [f"{SELFMON_METRIC_PREFIX}.duration,phase=cycle,environment.url={environment_url} {time.perf_counter() - self.started:.3f}"]
+
+        with self.lock:
+            for (name, dimensions), statistics in self.phases.items():
+                dimension_string = "".join(f",{dimension}={escape_dimension_value(value)}" for dimension, value in dimensions)
+                for field in FIELDS:
+                    if field == "duration" or statistics[field]:
+                        value = f"{statistics[field]:.3f}" if field == "duration" else statistics[field]
+                        lines.append(f"{SELFMON_METRIC_PREFIX}.{field},phase={name}{dimension_string},environment.url={environment_url} {value}")
+
+        return lines
+
+
+def record_request(attempts, bytes_received):
+    """
+    Records one API response (one page) for the current phase of the calling thread, if any
+    """
+    stack = _stack()
+    if stack:
+        frame = stack[-1]
+        frame.instrumentation.add(frame.key, requests=attempts, pages=1, retries=attempts - 1, bytes_received=bytes_received)
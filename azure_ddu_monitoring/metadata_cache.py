@@ -0,0 +1,143 @@
+import json, os, tempfile, threading, time
+from collections import OrderedDict
+from hashlib import sha256
+
+# Default time to live of cached metadata in minutes
+DEFAULT_METADATA_CACHE_TTL_MIN = 360
+
+# Maximum number of cached entities per environment, least recently used entities are evicted first
+DEFAULT_METADATA_CACHE_MAX_ENTRIES = 500000
+
+# Directory for persisted metadata caches
+METADATA_CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), "azure_ddu_monitoring")
+
+
+class MetadataCache:
+    """
+    Time to live cache of Azure subscriptions and entity metadata of one environment
+
+    Keeps entity name, type and subscription entity ID by entity ID, the Azure subscriptions
+    and the time every target (CUSTOM_DEVICE or Classic entity type) was last fully listed.
+    While a listing is fresh, only entities missing in the cache need to be fetched.
+    The cache can be persisted to disk, so a restarted extension starts warm.
+    """
+
+    def __init__(self, ttl_seconds, max_entries = DEFAULT_METADATA_CACHE_MAX_ENTRIES, path = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.path = path
+        self.lock = threading.Lock()
+
+        # Entity metadata by entity ID, ordered from least to most recently used
+        self.entities = OrderedDict()
+
+        # Azure Subscriptions by subscription entity ID and the time they were fetched
+        self.subscriptions = {}
+        self.subscriptions_timestamp = 0
+
+        # Time of the last full entity listing by target
+        self.listing_timestamps = {}
+
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def default_path(environment_url):
+        """
+        Returns the file a cache of the given environment is persisted to
+        """
+        return os.path.join(METADATA_CACHE_DIRECTORY, f"metadata_{sha256(environment_url.encode()).hexdigest()[:16]}.json")
+
+    def is_fresh(self, timestamp):
+        return time.time() - timestamp < self.ttl_seconds
+
+    def get_subscriptions(self):
+        """
+        Returns the cached Azure subscriptions or None if they are expired
+        """
+        with self.lock:
+            if self.subscriptions and self.is_fresh(self.subscriptions_timestamp):
+                return dict(self.subscriptions)
+            return None
+
+    def put_subscriptions(self, subscriptions):
+        with self.lock:
+            self.subscriptions = dict(subscriptions)
+            self.subscriptions_timestamp = time.time()
+
+    def is_listed(self, target):
+        """
+        Returns whether all entities of the given target were listed within the time to live
+        """
+        with self.lock:
+            return self.is_fresh(self.listing_timestamps.get(target, 0))
+
+    def mark_listed(self, target):
+        with self.lock:
+            self.listing_timestamps[target] = time.time()
+
+    def get(self, entity_id):
+        """
+        Returns the metadata of the given entity or None if it is not cached or expired
+        """
+        with self.lock:
+            entry = self.entities.get(entity_id)
+            if entry is None:
+                return None
+            if not self.is_fresh(entry["timestamp"]):
+                del self.entities[entity_id]
+                return None
+            self.entities.move_to_end(entity_id)
+            return entry
+
+    def put(self, entity_id, entity_name, entity_type, subscription_entity_id):
+        with self.lock:
+            self.entities[entity_id] = {
+                "entity_name": entity_name,
+                "entity_type": entity_type,
+                "subscription_entity_id": subscription_entity_id,
+                "timestamp": time.time()
+            }
+            self.entities.move_to_end(entity_id)
+
+            while len(self.entities) > self.max_entries:
+                self.entities.popitem(last=False)
+
+    def load(self):
+        """
+        Loads the persisted cache, a missing or unreadable file results in an empty cache
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        with self.lock:
+            self.subscriptions = data.get("subscriptions", {})
+            self.subscriptions_timestamp = data.get("subscriptions_timestamp", 0)
+            self.listing_timestamps = data.get("listing_timestamps", {})
+            self.entities = OrderedDict(data.get("entities", {}))
+
+    def save(self):
+        """
+        Persists the cache atomically, if a path is configured
+        """
+        if not self.path:
+            return
+
+        with self.lock:
+            data = {
+                "subscriptions": self.subscriptions,
+                "subscriptions_timestamp": self.subscriptions_timestamp,
+                "listing_timestamps": self.listing_timestamps,
+                "entities": self.entities
+            }
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(temporary_path, self.path)
+
+    def __len__(self):
+        return len(self.entities)
@@ -0,0 +1,117 @@
+import re, threading
+
+# Longer dimension values are truncated (limit of the metric ingestion protocol)
+MAX_DIMENSION_VALUE_LENGTH = 250
+
+# Whitespace other than spaces is not allowed in dimension values and replaced by an (escaped) space, other control characters are removed
+CONTROL_CHARACTER_TABLE = str.maketrans({**dict.fromkeys([*map(chr, range(0x20)), "\x7f"]), "\n": "\\ ", "\r": "\\ ", "\t": "\\ "})
+
+# Control characters other than the \0 separating joined dimension values
+CONTROL_CHARACTERS = re.compile("[\x01-\x1f\x7f]")
+
+
+def escape_dimension_value(value):
+    """
+    Returns a dimension value as it can be written into a metric line
+
+    Backslashes, commas, equal signs, spaces and quotes are escaped with a backslash, line
+    breaks and tabs are replaced by escaped spaces, other control characters (e.g. \0) are
+    removed and values are truncated to the maximum length of dimension values.
+    """
+    if not isinstance(value, str):
+        value = str(value)
+    if len(value) > MAX_DIMENSION_VALUE_LENGTH:
+        value = value[:MAX_DIMENSION_VALUE_LENGTH]
+
+    value = escape_characters(value)
+    if not value.isprintable():
+        value = value.translate(CONTROL_CHARACTER_TABLE)
+    return value
+
+
+def escape_characters(value):
+    # str.replace is several times faster than str.translate or a regular expression here
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ").replace("\"", "\\\"")
+
+
+class MintLineEncoder:
+    """
+    Encodes metric lines of one metric key and fixed set of dimensions
+
+    The metric key, the dimension keys and the constant dimensions (e.g. environment.url)
+    are escaped and joined into a line template once, so encoding a line only escapes the
+    variable dimension values.
+    """
+
+    def __init__(self, metric_key, dimension_keys, constant_dimensions = None):
+        self.metric_key = metric_key
+        self.dimension_keys = list(dimension_keys)
+
+        template = metric_key.replace("{", "{{").replace("}", "}}")
+        template += "".join(f",{key}={{}}" for key in self.dimension_keys)
+        for key, value in (constant_dimensions or {}).items():
+            template += f",{key}=" + escape_dimension_value(value).replace("{", "{{").replace("}", "}}")
+        self.template = template + " {}"
+
+    def encode(self, dimension_values, value, timestamp = None):
+        """
+        Returns the metric line of the given dimension values (in the order of dimension_keys) and value
+
+        An optional timestamp (epoch milliseconds) is appended, otherwise the line gets the
+        time of ingestion. All values are escaped at once as one joined string unless a value
+        needs more than escaping (truncation, control characters, no string) or contains the
+        separator itself.
+        """
+        try:
+            joined = "\0".join(dimension_values)
+        except TypeError:
+            joined = None
+
+        if joined is not None and len(joined) <= MAX_DIMENSION_VALUE_LENGTH and not CONTROL_CHARACTERS.search(joined):
+            escaped_values = escape_characters(joined).split("\0")
+            if len(escaped_values) == len(self.dimension_keys):
+                line = self.template.format(*escaped_values, value)
+                return line if timestamp is None else f"{line} {timestamp}"
+
+        line = self.template.format(*[escape_dimension_value(dimension_value) for dimension_value in dimension_values], value)
+        return line if timestamp is None else f"{line} {timestamp}"
+
+
+class MintLineSink:
+    """
+    Collects metric lines and hands them over to report at once when flushed
+
+    Lines can be added from several collection threads at once. Splitting them into
+    ingestion requests (line and payload size limits) is left to the extension SDK, which
+    buffers all reported lines and sends them in batches. With an Instrumentation,
+    reporting runs in its "ingestion" phase.
+    """
+
+    def __init__(self, report, instrumentation = None):
+        self.report = report
+        self.instrumentation = instrumentation
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.line_count = 0
+
+    def add(self, line):
+        with self.lock:
+            self.buffer.append(line)
+
+    def add_all(self, lines):
+        with self.lock:
+            self.buffer.extend(lines)
+
+    def flush(self):
+        with self.lock:
+            lines, self.buffer = self.buffer, []
+            self.line_count += len(lines)
+
+        if not lines:
+            return
+
+        if self.instrumentation is None:
+            return self.report(lines)
+
+        with self.instrumentation.phase("ingestion"):
+            self.report(lines)
@@ -0,0 +1,148 @@
+from .collection import CollectionEngine, ConsumptionCollector
+from .consumption_store import ConsumptionStore
+from .entity_index import EntityIndex
+from .instrumentation import Instrumentation
+from .mint_encoder import MintLineEncoder, MintLineSink
+
+# Metric keys and dimensions of reported consumption
+DDUS_BY_ENTITY_METRIC_KEY = "consumption.ddu.metrics.azure.ddus_by_entity"
+DDUS_BY_ENTITY_DIMENSIONS = ["dt.entity.custom_device", "entity.name", "entity.type", "azure.subscription.id", "azure.subscription.name"]
+DDUS_BY_SUBSCRIPTION_METRIC_KEY = "consumption.ddu.metrics.azure.ddus_by_subscription"
+DDUS_BY_SUBSCRIPTION_DIMENSIONS = ["azure.subscription.id", "azure.subscription.name"]
+DDUS_BY_ENTITY_TYPE_METRIC_KEY = "consumption.ddu.metrics.azure.ddus_by_entity_type"
+DDUS_BY_ENTITY_TYPE_DIMENSIONS = ["entity.type"]
+
+
+class ReportingPipeline:
+    """
+    Stages after collection: consumption record -> metric line -> report
+
+    In entity mode every record is encoded right away, without a list of all records of the
+    cycle, and its line is buffered in the sink. finish() hands all lines over to report at
+    once; the extension SDK buffers them until it sends them (every 30 seconds) and splits
+    them into ingestion requests. In subscription mode, and for the optional summary by
+    entity type, records are kept in a columnar ConsumptionStore and all summaries are
+    computed from it at once when collection has finished. Lines of earlier time windows
+    carry the window end as timestamp.
+    """
+
+    def __init__(self, report, environment_url, summarize_by_subscription, instrumentation = None, timestamp = None, summarize_by_entity_type = False):
+        self.environment_url = environment_url
+        self.summarize_by_subscription = summarize_by_subscription
+        self.summarize_by_entity_type = summarize_by_entity_type
+        self.timestamp = timestamp
+        self.instrumentation = instrumentation or Instrumentation()
+        self.sink = MintLineSink(report, self.instrumentation)
+
+        constant_dimensions = {"environment.url": environment_url}
+        self.entity_encoder = MintLineEncoder(DDUS_BY_ENTITY_METRIC_KEY, DDUS_BY_ENTITY_DIMENSIONS, constant_dimensions)
+        self.subscription_encoder = MintLineEncoder(DDUS_BY_SUBSCRIPTION_METRIC_KEY, DDUS_BY_SUBSCRIPTION_DIMENSIONS, constant_dimensions)
+        self.entity_type_encoder = MintLineEncoder(DDUS_BY_ENTITY_TYPE_METRIC_KEY, DDUS_BY_ENTITY_TYPE_DIMENSIONS, constant_dimensions)
+
+        # Records to summarize, only kept if any summary is reported
+        self.store = ConsumptionStore() if summarize_by_subscription or summarize_by_entity_type else None
+
+    def add(self, record):
+        """
+        Receives one consumption record from the collector
+        """
+        if not self.summarize_by_subscription:
+            dimension_values = (record.entity_id, record.entity_name, record.entity_type, record.subscription_id, record.subscription_name)
+            self.sink.add(self.entity_encoder.encode(dimension_values, record.metric_ddus, self.timestamp))
+
+        if self.store is not None:
+            self.store.add(record)
+
+    def finish(self):
+        """
+        Reports summarized and buffered lines and returns the number of reported lines
+
+        Only called once collection of all windows has finished, so the lines of a cycle
+        failing midway are never reported and its windows can be collected again.
+        """
+        if self.store is not None:
+            with self.instrumentation.phase("encoding"):
+                ddus_by_subscription, ddus_by_entity_type = self.store.summarize()
+
+                if self.summarize_by_subscription:
+                    for subscription, ddus in ddus_by_subscription:
+                        self.sink.add(self.subscription_encoder.encode(subscription, ddus, self.timestamp))
+
+                if self.summarize_by_entity_type:
+                    for entity_type, ddus in ddus_by_entity_type:
+                        self.sink.add(self.entity_type_encoder.encode((entity_type,), ddus, self.timestamp))
+
+        self.sink.flush()
+        return self.sink.line_count
+
+
+def run_collection_cycle(logger, api_client, time_from, time_to, report, summarize_by_subscription, max_concurrent_requests, metadata_cache = None, report_self_monitoring = False, catch_up_windows = (), summarize_by_entity_type = False, topology_index = None, profiler = None, commit = None):
+    """
+    Collects the DDU consumption of all Azure entities in the given time frame and reports it as metric lines
+
+    catch_up_windows are earlier (time_from, time_to, timestamp) windows, e.g. missed by
+    failed cycles, which are collected in the same pass and reported with the given
+    timestamp (epoch milliseconds). With summarize_by_entity_type, the consumption summed
+    up by entity type is reported in addition. A topology index (shared by the endpoints
+    of the environment) replaces entity listings per subscription. With
+    report_self_monitoring, the duration, requests, pages, bytes, retries and entities of
+    every phase of the cycle are reported as consumption.ddu.metrics.azure.selfmon.* metric
+    lines as well. A profiler is notified of every phase of the cycle. Returns the number
+    of collected records and the number of reported consumption lines.
+
+    The lines of every window are held until all windows were collected and only then
+    reported, so if any query fails nothing of the cycle is reported and the caller can
+    retry its windows without counting consumption twice. commit is called right after the
+    lines were released, before anything else can fail: persisting the metadata cache is
+    best-effort and only logged if it fails.
+    """
+    instrumentation = Instrumentation(profiler)
+
+    # Index of Azure Subscriptions and Azure entities by entity ID
+    entity_index = EntityIndex()
+
+    collector = ConsumptionCollector(logger, api_client, time_from, time_to, entity_index, metadata_cache=metadata_cache, instrumentation=instrumentation, topology_index=topology_index)
+    engine = CollectionEngine(max_concurrent_requests)
+
+    # Report consumption either by Azure subscription or Azure entity, once collection has finished
+    pipelines = [ReportingPipeline(report, api_client.environment_url, summarize_by_subscription, instrumentation=instrumentation, timestamp=timestamp, summarize_by_entity_type=summarize_by_entity_type) for _, _, timestamp in catch_up_windows]
+    pipelines.append(ReportingPipeline(report, api_client.environment_url, summarize_by_subscription, instrumentation=instrumentation, summarize_by_entity_type=summarize_by_entity_type))
+
+    windows = [(window_from, window_to, pipeline.add) for (window_from, window_to, _), pipeline in zip(catch_up_windows, pipelines)]
+    windows.append((time_from, time_to, pipelines[-1].add))
+
+
+    # Fetch all Azure Subscription entities
+    # ================================================================================================
+    collector.fetch_subscriptions()
+
+
+    # Collect and report DDU metric consumption of Cloud and Classic Azure entities for all subscriptions
+    # ================================================================================================
+    logger.info("Collecting consumption of Cloud and Classic Azure entities for all subscriptions.")
+
+    record_count = collector.collect_windows(engine, windows)
+
+    logger.info(f"Finished collection for total {record_count} entities.")
+
+    # Release the held lines of all windows only after every window was collected
+    line_count = sum(pipeline.finish() for pipeline in pipelines)
+
+    if commit is not None:
+        commit()
+
+    if line_count:
+        logger.info(f"Successfully reported {line_count} consumption metrics.")
+
+    if metadata_cache is not None:
+        try:
+            metadata_cache.save()
+        except OSError as e:
+            logger.warning(f"Could not persist the metadata cache: {e}")
+
+    if report_self_monitoring:
+        sink = MintLineSink(report)
+        sink.add_all(instrumentation.metric_lines(api_client.environment_url))
+        sink.flush()
+
+    return record_count, line_count
@@ -0,0 +1,74 @@
+DDU_METRIC_KEY = "builtin:billing.ddu.metrics.byEntity"
+
+# Filter matching all Cloud Azure entities (CUSTOM_DEVICE) that belong to any Azure subscription
+CUSTOM_DEVICE_FILTER = "in(\"dt.entity.monitored_entity\",entitySelector(\"type(~\"CUSTOM_DEVICE~\"),fromRelationship.belongsTo(type(~\"AZURE_SUBSCRIPTION~\"))\"))"
+
+# Target key for consumption of Cloud Azure entities
+CUSTOM_DEVICE = "CUSTOM_DEVICE"
+
+# Maximum length of a single metric selector, keeps request URLs well below common proxy and API limits
+MAX_METRIC_SELECTOR_LENGTH = 2000
+
+
+class MetricQuery:
+    """
+    One bulk DDU metric query and the targets (entity types) whose consumption it returns
+    """
+
+    def __init__(self, metric_selector, targets):
+        self.metric_selector = metric_selector
+        self.targets = targets
+
+    def __repr__(self):
+        return f"MetricQuery(targets={self.targets})"
+
+
+class QueryPlanner:
+    """
+    Plans the DDU metric queries of a collection cycle
+
+    Instead of one query per Azure subscription and one per Classic entity type, all
+    targets are combined into as few metric selectors as possible (one "or" filter split
+    by monitored entity), chunked so that no selector exceeds the maximum length. Every
+    result row is routed back to its target by the entity type prefix of its entity ID.
+    """
+
+    def __init__(self, max_selector_length = MAX_METRIC_SELECTOR_LENGTH):
+        self.max_selector_length = max_selector_length
+
+    @staticmethod
+    def target_filter(target):
+        if target == CUSTOM_DEVICE:
+            return CUSTOM_DEVICE_FILTER
+        # Trailing dash, so e.g. AZURE_VM does not match AZURE_VM_SCALE_SET entities
+        return f"prefix(\"dt.entity.monitored_entity\",\"{target}-\")"
+
+    @staticmethod
+    def metric_selector(filters):
+        condition = filters[0] if len(filters) == 1 else f"or({','.join(filters)})"
+        return f"{DDU_METRIC_KEY}:filter({condition}):splitBy(\"dt.entity.monitored_entity\"):fold(sum):names"
+
+    def plan(self, targets):
+        """
+        Returns the metric queries covering the given targets (CUSTOM_DEVICE and/or Classic entity types)
+        """
+        queries = []
+        chunk = []
+
+        for target in targets:
+            if chunk and len(self.metric_selector([self.target_filter(t) for t in chunk + [target]])) > self.max_selector_length:
+                queries.append(MetricQuery(self.metric_selector([self.target_filter(t) for t in chunk]), chunk))
+                chunk = []
+            chunk.append(target)
+
+        if chunk:
+            queries.append(MetricQuery(self.metric_selector([self.target_filter(t) for t in chunk]), chunk))
+
+        return queries
+
+    @staticmethod
+    def route(entity_id):
+        """
+        Returns the target of a result row by its entity ID, e.g. AZURE_VM for AZURE_VM-F0991A85FA6C2703
+        """
+        return entity_id.rsplit("-", 1)[0]
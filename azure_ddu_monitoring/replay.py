@@ -0,0 +1,186 @@
+import argparse, cProfile, logging, os, pstats, sys, threading, time, tracemalloc
+
+from .api_client import DynatraceApiClient
+from .cassette import LATENCY_ORIGINAL, LATENCY_ZERO, Cassette, ReplaySession
+from .pipeline import run_collection_cycle
+from .topology_index import TopologyIndex
+
+# Functions listed per phase in the CPU profile summary
+TOP_FUNCTIONS = 15
+
+# Allocation sites listed in the memory summary
+TOP_ALLOCATIONS = 15
+
+# A new allocation snapshot is taken when traced memory grew by this factor since the last one
+SNAPSHOT_GROWTH_FACTOR = 1.1
+
+
+class PhaseProfiler:
+    """
+    Profiles every phase of a collection cycle separately with cProfile and/or tracemalloc
+
+    Like the durations of the instrumentation, profiles are exclusive: while a nested phase
+    runs, only the profile of the nested phase is active. Code outside of any phase counts
+    for the "cycle" phase. With memory profiling, the net allocated and peak bytes of every
+    phase are traced, and the allocation sites are captured whenever traced memory reaches
+    a new high. Only phases of the thread that started the profiler are profiled, so the
+    cycle has to run with max_concurrent_requests = 1 to profile all of them.
+    """
+
+    def __init__(self, cpu = True, memory = False):
+        self.cpu = cpu
+        self.memory = memory
+        self.thread_id = None
+        self.stack = []
+
+        # cProfile profiles by phase
+        self.profiles = {}
+
+        # Net allocated and peak bytes by phase
+        self.allocations = {}
+        self.memory_started = 0
+        self.snapshot = None
+        self.snapshot_bytes = 0
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        if self.memory:
+            tracemalloc.start()
+        self.enter("cycle")
+
+    def stop(self):
+        self.exit("cycle")
+        if self.memory:
+            tracemalloc.stop()
+
+    def enter(self, name):
+        if threading.get_ident() != self.thread_id:
+            return
+
+        if self.stack:
+            self.pause(self.stack[-1])
+        self.stack.append(name)
+        self.resume(name)
+
+    def exit(self, name):
+        if threading.get_ident() != self.thread_id:
+            return
+
+        self.pause(self.stack.pop())
+        if self.stack:
+            self.resume(self.stack[-1])
+
+    def resume(self, name):
+        if self.memory:
+            tracemalloc.reset_peak()
+            self.memory_started = tracemalloc.get_traced_memory()[0]
+        if self.cpu:
+            self.profiles.setdefault(name, cProfile.Profile()).enable()
+
+    def pause(self, name):
+        if self.cpu:
+            self.profiles[name].disable()
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            allocations = self.allocations.setdefault(name, {"net": 0, "peak": 0})
+            allocations["net"] += current - self.memory_started
+            allocations["peak"] = max(allocations["peak"], peak - self.memory_started)
+
+            if current > self.snapshot_bytes * SNAPSHOT_GROWTH_FACTOR:
+                self.snapshot = tracemalloc.take_snapshot()
+                self.snapshot_bytes = current
+
+    def report(self, stream = sys.stdout, profile_directory = None):
+        """
+        Writes the hot spots of every phase to stream and the cProfile profiles to profile_directory (one <phase>.prof each)
+        """
+        if self.cpu:
+            statistics_by_phase = [(name, pstats.Stats(profile, stream=stream)) for name, profile in self.profiles.items() if profile.getstats()]
+            statistics_by_phase.sort(key=lambda item: item[1].total_tt, reverse=True)
+
+            for name, statistics in statistics_by_phase:
+                stream.write(f"\n==== CPU profile of phase {name}: {statistics.total_tt:.3f}s ====\n")
+                statistics.sort_stats("tottime").print_stats(TOP_FUNCTIONS)
+
+                if profile_directory:
+                    os.makedirs(profile_directory, exist_ok=True)
+                    statistics.dump_stats(os.path.join(profile_directory, f"{name}.prof"))
+
+        if self.memory:
+            stream.write(f"\n==== Allocations by phase ====\n{'phase':<30} {'net [KiB]':>12} {'peak [KiB]':>12}\n")
+            for name, allocations in sorted(self.allocations.items(), key=lambda item: item[1]["peak"], reverse=True):
+                stream.write(f"{name:<30} {allocations['net'] / 1024:>12.1f} {allocations['peak'] / 1024:>12.1f}\n")
+
+            if self.snapshot is not None:
+                stream.write(f"\n==== Allocation sites at {self.snapshot_bytes / 1024:.0f} KiB traced ====\n")
+                for statistic in self.snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                    stream.write(f"{statistic}\n")
+
+
+def run_replay(logger, cassette, report, latency = LATENCY_ORIGINAL, profiler = None):
+    """
+    Runs the collection cycle recorded in the cassette again with the recorded responses
+
+    The cycle runs with the recorded parameters and time windows, without metadata cache
+    and with a new topology index like the recorded cycle. With a profiler it runs on a
+    single thread. Returns the number of collected records, reported lines and the wall time.
+    """
+    header = cassette.header
+    max_concurrent_requests = 1 if profiler is not None else header["max_concurrent_requests"]
+
+    api_client = DynatraceApiClient(header["environment_url"], "replay", True, max_concurrent_requests, logger)
+    api_client.session = ReplaySession(cassette, header["environment_url"], latency)
+
+    topology_index = TopologyIndex() if header["use_topology_index"] else None
+    catch_up_windows = [tuple(window) for window in header["catch_up_windows"]]
+
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.start()
+    try:
+        record_count, line_count = run_collection_cycle(logger, api_client, header["time_from"], header["time_to"], report, header["summarize_by_subscription"], max_concurrent_requests, None, header["report_self_monitoring"], catch_up_windows, header["summarize_by_entity_type"], topology_index, profiler)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        api_client.close()
+
+    return record_count, line_count, time.perf_counter() - start
+
+
+def main(argv = None):
+    """
+    Command line entry point: python -m azure_ddu_monitoring replay --help
+    """
+    parser = argparse.ArgumentParser(prog="python -m azure_ddu_monitoring replay", description="Replays a collection cycle recorded to a cassette, optionally profiling every phase")
+    parser.add_argument("cassette", help="cassette file recorded with the record_cassette endpoint option")
+    parser.add_argument("--latency", choices=[LATENCY_ORIGINAL, LATENCY_ZERO], default=LATENCY_ORIGINAL, help="delay responses as recorded or not at all")
+    parser.add_argument("--cpu", action="store_true", help="profile every phase with cProfile")
+    parser.add_argument("--memory", action="store_true", help="trace allocations of every phase with tracemalloc")
+    parser.add_argument("--profile-dir", help="directory the cProfile profiles are written to, one <phase>.prof per phase")
+    parser.add_argument("--lines", help="file the reported metric lines are written to")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s", stream=sys.stderr)
+    logger = logging.getLogger("azure_ddu_monitoring.replay")
+
+    cassette = Cassette(args.cassette)
+    profiler = PhaseProfiler(args.cpu, args.memory) if args.cpu or args.memory else None
+
+    lines_file = open(args.lines, "w", encoding="utf-8") if args.lines else None
+    lines_lock = threading.Lock()
+
+    def report(lines):
+        if lines_file is not None:
+            with lines_lock:
+                lines_file.write("".join(line + "\n" for line in lines))
+
+    try:
+        record_count, line_count, seconds = run_replay(logger, cassette, report, args.latency, profiler)
+    finally:
+        if lines_file is not None:
+            lines_file.close()
+
+    print(f"Replayed {len(cassette)} responses recorded at {cassette.header.get('recorded_at')}: {record_count} records, {line_count} lines in {seconds:.3f}s")
+
+    if profiler is not None:
+        profiler.report(sys.stdout, args.profile_dir)
@@ -0,0 +1,175 @@
+import random, threading, time
+
+import requests
+
+# HTTP status codes of transient errors which are retried
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Default number of retries per request
+DEFAULT_MAX_RETRIES = 5
+
+# Base and maximum delay in seconds of the exponential backoff
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 60.0
+
+# Number of successful requests after which the concurrency limit is raised by one again
+SUCCESSES_PER_CONCURRENCY_INCREASE = 10
+
+
+class RequestScheduler:
+    """
+    Sends requests to one Dynatrace environment with retries and adaptive concurrency
+
+    Transient errors (throttling, 5xx, connection errors) are retried with jittered
+    exponential backoff. The Retry-After and X-RateLimit-* headers of the API pause all
+    requests to the environment until the given time. The number of requests running at
+    once starts at the configured maximum, is halved on every throttled response and is
+    raised again step by step after successful requests (additive increase, multiplicative
+    decrease), so the request rate settles just below the tenant's rate limit.
+
+    An optional budget (semaphore) shared by the schedulers of all environments bounds the
+    number of requests running at once across environments.
+    """
+
+    def __init__(self, max_concurrency, max_retries = DEFAULT_MAX_RETRIES, backoff_base = DEFAULT_BACKOFF_BASE, backoff_max = DEFAULT_BACKOFF_MAX, logger = None, budget = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.budget = budget
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.logger = logger
+
+        self.condition = threading.Condition()
+        self.concurrency_limit = self.max_concurrency
+        self.active_requests = 0
+        self.successes = 0
+
+        # No request is sent before this time (time.monotonic), set by throttled responses
+        self.paused_until = 0.0
+
+        # Statistics since creation
+        self.request_count = 0
+        self.retry_count = 0
+        self.throttled_count = 0
+
+    def send(self, request):
+        """
+        Calls request() (returning a requests.Response) until it succeeds or retries are exhausted
+
+        Returns the last response, connection errors of the last attempt and all other
+        exceptions of request() are raised.
+        """
+        attempt = 0
+        while(True):
+            # The slots are returned whatever request() raises, only connection errors and timeouts are retried
+            self.acquire()
+            try:
+                response = request()
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt >= self.max_retries:
+                    raise
+                response = None
+                delay = self.backoff_delay(attempt)
+                self.log_retry(f"{type(error).__name__}", attempt, delay)
+            finally:
+                self.release()
+
+            if response is not None:
+                self.observe(response)
+
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+                self.log_retry(f"HTTP {response.status_code}", attempt, delay)
+
+            attempt += 1
+            with self.condition:
+                self.retry_count += 1
+            time.sleep(delay)
+
+    def acquire(self):
+        with self.condition:
+            while(True):
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                elif self.active_requests >= self.concurrency_limit:
+                    self.condition.wait()
+                else:
+                    break
+            self.active_requests += 1
+            self.request_count += 1
+
+        if self.budget is not None:
+            self.budget.acquire()
+
+    def release(self):
+        if self.budget is not None:
+            self.budget.release()
+
+        with self.condition:
+            self.active_requests -= 1
+            self.condition.notify_all()
+
+    def observe(self, response):
+        """
+        Adapts concurrency limit and pause to the response
+        """
+        with self.condition:
+            if response.status_code == 429:
+                self.throttled_count += 1
+                self.successes = 0
+                self.concurrency_limit = max(1, self.concurrency_limit // 2)
+                self.pause(self.retry_after(response))
+            elif response.status_code < 400:
+                self.successes += 1
+                if self.successes >= SUCCESSES_PER_CONCURRENCY_INCREASE and self.concurrency_limit < self.max_concurrency:
+                    self.successes = 0
+                    self.concurrency_limit += 1
+
+                # Pause proactively if the rate limit of the current period is used up
+                if response.headers.get("X-RateLimit-Remaining") == "0":
+                    self.pause(self.rate_limit_reset(response))
+
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        if seconds:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def backoff_delay(self, attempt):
+        """
+        Returns the delay before the given retry attempt (exponential backoff with full jitter)
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def retry_after(self, response):
+        """
+        Returns the delay in seconds requested by the API or None
+        """
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        return self.rate_limit_reset(response)
+
+    def rate_limit_reset(self, response):
+        """
+        Returns the seconds until the rate limit resets (X-RateLimit-Reset, epoch microseconds) or None
+        """
+        rate_limit_reset = response.headers.get("X-RateLimit-Reset")
+        if rate_limit_reset is None:
+            return None
+        try:
+            return min(self.backoff_max, max(0.0, int(rate_limit_reset) / 1000000 - time.time()))
+        except ValueError:
+            return None
+
+    def log_retry(self, reason, attempt, delay):
+        if self.logger is not None:
+            self.logger.warning(f"{reason}, retrying request in {delay:.1f}s (retry {attempt + 1} of {self.max_retries}, concurrency limit {self.concurrency_limit}).")
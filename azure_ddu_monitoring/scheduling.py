@@ -0,0 +1,55 @@
+import threading, time
+
+# Maximum number of API requests running at once across all endpoints, raised to the largest
+# max_concurrent_requests of a single endpoint, so no endpoint setting is silently capped
+GLOBAL_MAX_CONCURRENT_REQUESTS = 16
+
+# Offset in seconds of the first cycle of the first endpoint
+INITIAL_OFFSET_SECONDS = 5
+
+
+class EndpointScheduler:
+    """
+    Spreads the collection cycles of all endpoints across their interval
+
+    Endpoints are offset evenly instead of all starting at the same moment, and all API
+    clients share one budget of concurrent requests. Overlapping cycles of one endpoint
+    are already skipped by the extension SDK, cycles still running at their deadline are
+    reported by a CycleDeadline.
+    """
+
+    def __init__(self, max_concurrent_requests_per_endpoint = (), global_max_concurrent_requests = GLOBAL_MAX_CONCURRENT_REQUESTS):
+        self.global_max_concurrent_requests = max([global_max_concurrent_requests, *max_concurrent_requests_per_endpoint])
+        self.request_budget = threading.BoundedSemaphore(self.global_max_concurrent_requests)
+
+    @staticmethod
+    def offset_seconds(index, count, interval_seconds):
+        """
+        Returns the offset of the first cycle of the index-th of count endpoints
+        """
+        return INITIAL_OFFSET_SECONDS + interval_seconds * index / max(1, count)
+
+
+class CycleDeadline:
+    """
+    Logs a warning whenever a running collection cycle passes another multiple of its interval
+
+    The extension SDK only warns about an overrun once the cycle returned and silently skips
+    all runs in between, so a hung cycle (e.g. blocked on a request) would go unnoticed.
+    Call finish() when the cycle ends.
+    """
+
+    def __init__(self, name, interval_seconds, logger):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.logger = logger
+        self.started = time.monotonic()
+        self.finished = threading.Event()
+        threading.Thread(target=self.watch, name=f"cycle-deadline {name}", daemon=True).start()
+
+    def watch(self):
+        while not self.finished.wait(self.interval_seconds):
+            self.logger.warning(f"Collection cycle of {self.name} still running after {time.monotonic() - self.started:.0f}s, exceeding its interval of {self.interval_seconds:.0f}s. Later cycles are skipped until it finishes.")
+
+    def finish(self):
+        self.finished.set()
@@ -0,0 +1,117 @@
+import json, os, threading, time
+from hashlib import sha256
+
+from .metadata_cache import METADATA_CACHE_DIRECTORY
+
+# Default time range in minutes that is caught up after missed or failed cycles
+DEFAULT_MAX_CATCH_UP_MIN = 60
+
+# Window boundaries are aligned to full minutes
+WINDOW_ALIGNMENT_SECONDS = 60
+
+
+class WindowTracker:
+    """
+    Tracks the end of the last successfully reported time window of one endpoint
+
+    Windows are aligned to full minutes and start exactly where the previous window ended,
+    so scheduler jitter neither leaves gaps nor counts consumption twice. After missed or
+    failed cycles, the range since the last reported window (limited to max_catch_up_seconds)
+    is split into windows of the query interval. The window end is persisted, so catching
+    up also works across extension restarts.
+    """
+
+    def __init__(self, max_catch_up_seconds = DEFAULT_MAX_CATCH_UP_MIN*60, path = None, logger = None):
+        self.max_catch_up_seconds = max_catch_up_seconds
+        self.path = path
+        self.logger = logger
+        self.lock = threading.Lock()
+
+        # End (epoch seconds) of the last successfully reported window
+        self.window_end = None
+
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def default_path(name):
+        """
+        Returns the file the window end of the given endpoint is persisted to
+
+        The name identifying the endpoint is hashed, so it may contain secrets like the API token.
+        """
+        return os.path.join(METADATA_CACHE_DIRECTORY, f"window_{sha256(name.encode()).hexdigest()[:16]}.json")
+
+    def pending_windows(self, interval_seconds, now = None):
+        """
+        Returns the (start, end) windows in epoch seconds to collect now, oldest first
+
+        The last window ends at the current full minute. All windows are interval_seconds
+        long, except the oldest one which additionally covers the remainder of the range
+        (up to a full interval), so a cycle starting slightly late or early does not create
+        a separate tiny window.
+        """
+        end = int(now if now is not None else time.time()) // WINDOW_ALIGNMENT_SECONDS * WINDOW_ALIGNMENT_SECONDS
+
+        with self.lock:
+            start = self.window_end
+
+        if start is None:
+            start = end - interval_seconds
+
+        earliest_start = end - max(interval_seconds, self.max_catch_up_seconds)
+        if start < earliest_start:
+            if self.logger:
+                self.logger.warning(f"Skipping {(earliest_start - start) // 60} min of consumption older than the maximum catch-up range.")
+            start = earliest_start
+
+        if start >= end:
+            return []
+
+        window_count = max(1, (end - start) // interval_seconds)
+        first_end = end - (window_count - 1) * interval_seconds
+
+        windows = [(start, first_end)]
+        for window_start in range(first_end, end, interval_seconds):
+            windows.append((window_start, window_start + interval_seconds))
+        return windows
+
+    def commit(self, window_end):
+        """
+        Records window_end as end of the last successfully reported window and persists it
+
+        Persisting is best-effort: if it fails, the window is still skipped by the next
+        cycles of this process and only a restart could report it again.
+        """
+        with self.lock:
+            self.window_end = window_end
+
+        try:
+            self.save()
+        except OSError as e:
+            if self.logger:
+                self.logger.warning(f"Could not persist the last reported time window: {e}")
+
+    def load(self):
+        """
+        Loads the persisted window end, a missing or unreadable file starts without one
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.window_end = json.load(f).get("window_end")
+        except (OSError, ValueError, AttributeError):
+            return
+
+    def save(self):
+        """
+        Persists the window end atomically, if a path is configured
+        """
+        if not self.path:
+            return
+
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump({"window_end": self.window_end}, f)
+            os.replace(temporary_path, self.path)
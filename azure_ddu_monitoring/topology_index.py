@@ -0,0 +1,82 @@
+import sys, threading, time
+
+# Time in minutes a loaded topology is reused (by all endpoints of the environment) before it is loaded again
+DEFAULT_TOPOLOGY_MAX_AGE_MIN = 15
+
+# Subscriptions per page of the topology query, every subscription carries the relationships of all its entities
+TOPOLOGY_PAGE_SIZE = 25
+
+# Relationships of Cloud Azure entities (CUSTOM_DEVICE) and of Classic entities to their Azure subscription
+TOPOLOGY_FIELDS = "+properties.azureSubscriptionUuid,+toRelationships.belongsTo,+toRelationships.isAccessibleBy"
+
+
+class TopologyIndex:
+    """
+    Azure subscription of every Azure entity of one Dynatrace environment
+
+    The whole topology is loaded with a single paged query of all Azure Subscription entities
+    and their relationships: Cloud Azure entities belong to their subscription, Classic
+    entities are accessible by it. Looking up the subscription and type of any entity is a
+    constant time dictionary lookup, independent of the number of subscriptions and entity
+    types. A loaded topology is reused until it is older than max_age_seconds and can be
+    shared by all endpoints of the same environment; refreshing it is serialized, so
+    concurrent cycles load it only once.
+    """
+
+    def __init__(self, max_age_seconds = DEFAULT_TOPOLOGY_MAX_AGE_MIN*60):
+        self.max_age_seconds = max_age_seconds
+        self.lock = threading.Lock()
+
+        # Time the topology was last loaded
+        self.loaded_at = None
+
+        # Azure Subscriptions by subscription entity ID, in the format of the entity index
+        self.subscriptions = {}
+
+        # Entity type and subscription entity ID by entity ID
+        self.entities = {}
+
+    def is_fresh(self):
+        return self.loaded_at is not None and time.time() - self.loaded_at < self.max_age_seconds
+
+    def refresh(self, api_client, time_from = "now-24h", time_to = None, instrumentation = None):
+        """
+        Loads the topology unless it is fresh, returns True if it was loaded
+
+        The loaded topology replaces the previous one at once, so lookups during a refresh
+        see either the old or the new topology.
+        """
+        with self.lock:
+            if self.is_fresh():
+                return False
+
+            subscriptions = {}
+            entities = {}
+
+            for subscription_entities in api_client.iter_entities("type(AZURE_SUBSCRIPTION)", TOPOLOGY_FIELDS, time_from=time_from, time_to=time_to, page_size=TOPOLOGY_PAGE_SIZE):
+                for subscription_entity in subscription_entities:
+                    subscription_entity_id = subscription_entity["entityId"]
+                    subscriptions[subscription_entity_id] = {
+                        "subscription_id": subscription_entity["properties"]["azureSubscriptionUuid"],
+                        "subscription_name": subscription_entity["displayName"]
+                    }
+
+                    to_relationships = subscription_entity.get("toRelationships", {})
+                    for related_entity in to_relationships.get("belongsTo", []) + to_relationships.get("isAccessibleBy", []):
+                        entities[related_entity["id"]] = (sys.intern(related_entity["type"]), subscription_entity_id)
+
+                if instrumentation is not None:
+                    instrumentation.add_entities(len(subscription_entities))
+
+            self.subscriptions, self.entities = subscriptions, entities
+            self.loaded_at = time.time()
+            return True
+
+    def get(self, entity_id):
+        """
+        Returns entity type and subscription entity ID of the given entity or None if it is not in the topology
+        """
+        return self.entities.get(entity_id)
+
+    def __len__(self):
+        return len(self.entities)
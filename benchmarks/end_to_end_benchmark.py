@@ -0,0 +1,107 @@
+"""
+End-to-end benchmark of collection cycles against the mock Dynatrace API
+
+For several topology sizes a mock API is started and a separate process runs a cold and
+a warm (metadata cache filled) collection cycle with the extension's collection logic.
+Records wall time, API requests and bytes received per cycle and the peak RSS of the
+collecting process so far. Both cycles run in the same process (the warm cycle needs the
+cache of the cold one), so the peak RSS of the warm cycle is the peak of both cycles.
+
+Usage: python benchmarks/end_to_end_benchmark.py [--latency-ms 20] [--throttle-rate 50] [--consuming-ratio 0.5] [--topology-index]
+"""
+import argparse, json, logging, resource, subprocess, sys, time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mock_dynatrace_api import MockDynatraceApi, Topology
+
+API_TOKEN = "benchmark-token"
+
+# Subscriptions, Cloud Azure entities per subscription, entities per Classic type
+SCALES = [
+    (5, 20, 50),
+    (20, 100, 500),
+    (80, 250, 2000)
+]
+
+CYCLES = ["cold", "warm"]
+
+
+def run_cycles(environment_url, max_concurrent_requests, use_topology_index):
+    """
+    Runs in the child process: one collection cycle per entry of CYCLES, waiting for the parent in between
+    """
+    from azure_ddu_monitoring.api_client import DynatraceApiClient
+    from azure_ddu_monitoring.metadata_cache import MetadataCache
+    from azure_ddu_monitoring.pipeline import run_collection_cycle
+    from azure_ddu_monitoring.topology_index import TopologyIndex
+
+    logger = logging.getLogger("benchmark")
+    logger.setLevel(logging.ERROR)
+    api_client = DynatraceApiClient(environment_url, API_TOKEN, True, max_concurrent_requests, logger)
+    metadata_cache = MetadataCache(3600)
+    topology_index = TopologyIndex() if use_topology_index else None
+
+    for cycle in CYCLES:
+        datetime_to = datetime.now(timezone.utc)
+        datetime_from = datetime_to - timedelta(minutes=15)
+
+        start = time.perf_counter()
+        record_count, line_count = run_collection_cycle(logger, api_client, datetime_from.isoformat(timespec='milliseconds'), datetime_to.isoformat(timespec='milliseconds'), lambda lines: None, False, max_concurrent_requests, metadata_cache, topology_index=topology_index)
+        seconds = time.perf_counter() - start
+
+        print(json.dumps({
+            "cycle": cycle,
+            "seconds": seconds,
+            "records": record_count,
+            "process_peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        }), flush=True)
+        sys.stdin.readline()
+
+
+def benchmark(scale, args):
+    topology = Topology(*scale, consuming_ratio=args.consuming_ratio)
+    server = MockDynatraceApi(topology, latency=args.latency_ms / 1000, throttle_rate=args.throttle_rate, api_token=API_TOKEN).start()
+
+    child = subprocess.Popen(
+        [sys.executable, __file__, "--cycle", server.url, "--max-concurrent-requests", str(args.max_concurrent_requests)] + (["--topology-index"] if args.topology_index else []),
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    results = []
+    for _ in CYCLES:
+        result = json.loads(child.stdout.readline())
+        result.update(requests=server.request_count, throttled=server.throttled_count, kib=server.bytes_sent / 1024, entities=len(topology.entities))
+        results.append(result)
+        server.reset_statistics()
+        child.stdin.write("\n")
+        child.stdin.flush()
+
+    child.wait()
+    server.shutdown()
+    server.server_close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--throttle-rate", type=int, default=None)
+    parser.add_argument("--max-concurrent-requests", type=int, default=4)
+    parser.add_argument("--consuming-ratio", type=float, default=0.5, help="share of entities with DDU consumption")
+    parser.add_argument("--topology-index", action="store_true", help="resolve subscriptions with a topology index")
+    parser.add_argument("--cycle", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cycle:
+        return run_cycles(args.cycle, args.max_concurrent_requests, args.topology_index)
+
+    print(f"{'entities':>9} {'cycle':>6} {'records':>8} {'wall [s]':>9} {'requests':>9} {'throttled':>10} {'received [KiB]':>15} {'process peak RSS [MiB]':>23}")
+    for scale in SCALES:
+        for result in benchmark(scale, args):
+            print(f"{result['entities']:>9} {result['cycle']:>6} {result['records']:>8} {result['seconds']:>9.2f} {result['requests']:>9} {result['throttled']:>10} {result['kib']:>15.0f} {result['process_peak_rss_mib']:>23.1f}")
+
+
+if __name__ == "__main__":
+    main()
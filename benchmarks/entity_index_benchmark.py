@@ -0,0 +1,100 @@
+"""
+Benchmark of joining DDU consumption rows against fetched Azure entities
+
+Compares the former linear scan per consumption row with the hashed EntityIndex.
+
+Usage: python benchmarks/entity_index_benchmark.py
+"""
+import sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from azure_ddu_monitoring.entity_index import EntityIndex
+
+SUBSCRIPTION_COUNT = 80
+
+# Linear join is O(rows x entities) and not measured beyond this size
+LINEAR_MAX_ENTITIES = 10000
+
+
+def generate(entity_count):
+    subscriptions = [
+        {
+            "entityId": f"AZURE_SUBSCRIPTION-{i:016X}",
+            "displayName": f"subscription-{i}",
+            "properties": {"azureSubscriptionUuid": f"{i:08x}-0000-0000-0000-000000000000"}
+        }
+        for i in range(SUBSCRIPTION_COUNT)
+    ]
+    entities = [
+        {
+            "entityId": f"AZURE_VM-{i:016X}",
+            "displayName": f"vm-{i}",
+            "type": "AZURE_VM",
+            "fromRelationships": {
+                "isAccessibleBy": [
+                    {"id": f"AZURE_RESOURCE_GROUP-{i % 500:016X}", "type": "AZURE_RESOURCE_GROUP"},
+                    {"id": subscriptions[i % SUBSCRIPTION_COUNT]["entityId"], "type": "AZURE_SUBSCRIPTION"}
+                ]
+            }
+        }
+        for i in range(entity_count)
+    ]
+    rows = [
+        {"dimensionMap": {"dt.entity.monitored_entity": entity["entityId"]}, "values": [1.0]}
+        for entity in reversed(entities)
+    ]
+    return subscriptions, entities, rows
+
+
+def linear_join(subscriptions, entities, rows):
+    subscription_entity_dict = {
+        subscription["entityId"]: subscription["properties"]["azureSubscriptionUuid"] for subscription in subscriptions
+    }
+    joined = 0
+    for row in rows:
+        entity_id = row["dimensionMap"]["dt.entity.monitored_entity"]
+        entity = next((entity for entity in entities if entity["entityId"] == entity_id), None)
+        if entity is not None:
+            subscription_entity = next((accessible_by for accessible_by in entity["fromRelationships"]["isAccessibleBy"] if accessible_by["type"] == "AZURE_SUBSCRIPTION"), None)
+            if subscription_entity is not None and subscription_entity_dict[subscription_entity["id"]]:
+                joined += 1
+    return joined
+
+
+def indexed_join(subscriptions, entities, rows):
+    entity_index = EntityIndex()
+    entity_index.add_subscriptions(subscriptions)
+    entity_index.add_entities(entities)
+    joined = 0
+    for row in rows:
+        entity_id = row["dimensionMap"]["dt.entity.monitored_entity"]
+        if entity_index.get(entity_id) is not None and entity_index.subscription_of(entity_id) is not None:
+            joined += 1
+    return joined
+
+
+def measure(join, *data):
+    start = time.perf_counter()
+    joined = join(*data)
+    return time.perf_counter() - start, joined
+
+
+def main():
+    print(f"{'entities':>10} {'linear [s]':>12} {'indexed [s]':>12} {'speedup':>10}")
+    for entity_count in (1000, 5000, 10000, 50000, 100000):
+        data = generate(entity_count)
+        indexed_seconds, joined = measure(indexed_join, *data)
+        assert joined == entity_count
+
+        if entity_count <= LINEAR_MAX_ENTITIES:
+            linear_seconds, joined = measure(linear_join, *data)
+            assert joined == entity_count
+            print(f"{entity_count:>10} {linear_seconds:>12.4f} {indexed_seconds:>12.4f} {linear_seconds / indexed_seconds:>9.0f}x")
+        else:
+            print(f"{entity_count:>10} {'-':>12} {indexed_seconds:>12.4f} {'-':>10}")
+
+
+if __name__ == "__main__":
+    main()
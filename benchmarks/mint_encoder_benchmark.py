@@ -0,0 +1,69 @@
+"""
+Throughput benchmark of encoding consumption metric lines
+
+Encodes 100k consumption records with the former f-string encoding and with the
+MintLineEncoder (which also escapes dimension values). Batching the lines into ingestion
+requests is done by the extension SDK and not measured.
+
+Usage: python benchmarks/mint_encoder_benchmark.py [--records 100000]
+"""
+import argparse, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from azure_ddu_monitoring.collection import ConsumptionRecord
+from azure_ddu_monitoring.pipeline import DDUS_BY_ENTITY_DIMENSIONS, DDUS_BY_ENTITY_METRIC_KEY, MintLineEncoder
+
+ENVIRONMENT_URL = "https://benchmark.live.dynatrace.com"
+SUBSCRIPTION_COUNT = 80
+
+
+def generate(record_count):
+    return [
+        ConsumptionRecord(
+            f"AZURE_VM-{i:016X}",
+            f"vm {i}" if i % 4 == 0 else f"vm-{i}", # every 4th name needs escaping
+            "AZURE_VM",
+            f"{i % SUBSCRIPTION_COUNT:08x}-0000-4000-8000-000000000000",
+            f"Subscription {i % SUBSCRIPTION_COUNT}, Production",
+            0.25
+        )
+        for i in range(record_count)
+    ]
+
+
+def fstring_encoding(records):
+    lines = []
+    for record in records:
+        dimensions = f"dt.entity.custom_device={record.entity_id},entity.name={record.entity_name},entity.type={record.entity_type},azure.subscription.id={record.subscription_id},azure.subscription.name={record.subscription_name},environment.url={ENVIRONMENT_URL}"
+        lines.append(f"consumption.ddu.metrics.azure.ddus_by_entity,{dimensions} {record.metric_ddus}")
+    return lines
+
+
+def encoder_encoding(records):
+    encoder = MintLineEncoder(DDUS_BY_ENTITY_METRIC_KEY, DDUS_BY_ENTITY_DIMENSIONS, {"environment.url": ENVIRONMENT_URL})
+    return [encoder.encode((record.entity_id, record.entity_name, record.entity_type, record.subscription_id, record.subscription_name), record.metric_ddus) for record in records]
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    args = parser.parse_args()
+
+    records = generate(args.records)
+
+    print(f"{'encoding':<28} {'seconds':>8} {'lines/s':>10}")
+    for name, function in (("f-string (unescaped)", fstring_encoding), ("MintLineEncoder", encoder_encoding)):
+        seconds, lines = measure(function, records)
+        print(f"{name:<28} {seconds:>8.3f} {len(lines) / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
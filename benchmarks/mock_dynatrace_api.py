@@ -0,0 +1,292 @@
+"""
+Local stand-in for the Dynatrace entities and metrics query API
+
+Serves a synthetic Azure topology (N subscriptions, M Cloud Azure entities per subscription,
+K Classic entities per Classic type) on /api/v2/entities and /api/v2/metrics/query. It
+supports the selectors used by the extension, pagination with nextPageKey, gzip, response
+latency and throttling with 429 responses, and counts requests and bytes sent.
+
+Usage: python benchmarks/mock_dynatrace_api.py --port 8080 --subscriptions 10 --custom-devices 100 --classic-entities 500
+"""
+import argparse, gzip, json, random, re, sys, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from azure_ddu_monitoring.collection import CLASSIC_TYPES
+
+# Maximum page sizes of the real API
+MAX_ENTITIES_PAGE_SIZE = 500
+MAX_METRICS_PAGE_SIZE = 10000
+
+
+class Topology:
+    """
+    Synthetic Azure entities by entity ID
+    """
+
+    def __init__(self, subscriptions, custom_devices, classic_entities, consuming_ratio = 0.5, seed = 1):
+        rng = random.Random(seed)
+        self.entities = {}
+        self.subscription_uuids = {}
+
+        # Entities by subscription entity ID, for the relationships of subscriptions
+        self.members = {}
+
+        subscription_entity_ids = []
+        for s in range(subscriptions):
+            subscription_entity_id = f"AZURE_SUBSCRIPTION-{s:016X}"
+            subscription_uuid = f"{s:08x}-0000-4000-8000-000000000000"
+            subscription_entity_ids.append(subscription_entity_id)
+            self.subscription_uuids[subscription_entity_id] = subscription_uuid
+            self.add(subscription_entity_id, f"Subscription {s}", "AZURE_SUBSCRIPTION", None, None)
+
+            for m in range(custom_devices):
+                ddus = round(rng.uniform(0.1, 50), 3) if rng.random() < consuming_ratio else None
+                self.add(f"CUSTOM_DEVICE-{s:08X}{m:08X}", f"azure-resource-{s}-{m}", "CUSTOM_DEVICE", subscription_entity_id, ddus)
+
+        for t, classic_type in enumerate(CLASSIC_TYPES):
+            for k in range(classic_entities):
+                ddus = round(rng.uniform(0.1, 50), 3) if rng.random() < consuming_ratio else None
+                self.add(f"{classic_type}-{t:04X}{k:012X}", f"{classic_type.lower()}-{k}", classic_type, rng.choice(subscription_entity_ids), ddus)
+
+    def add(self, entity_id, name, entity_type, subscription_entity_id, ddus):
+        self.entities[entity_id] = {
+            "entityId": entity_id,
+            "displayName": name,
+            "type": entity_type,
+            "subscription": subscription_entity_id,
+            "ddus": ddus
+        }
+        if subscription_entity_id:
+            self.members.setdefault(subscription_entity_id, []).append(self.entities[entity_id])
+
+    def select(self, entity_selector):
+        """
+        Returns the entities matching an entity selector as used by the extension
+        """
+        match = re.search(r"entityId\(([^)]*)\)", entity_selector)
+        if match:
+            entity_ids = [entity_id.strip().strip('"') for entity_id in match.group(1).split(",")]
+            return [self.entities[entity_id] for entity_id in entity_ids if entity_id in self.entities]
+
+        entity_type = re.match(r"type\((\w+)\)", entity_selector).group(1)
+        entities = [entity for entity in self.entities.values() if entity["type"] == entity_type]
+
+        match = re.search(r"azureSubscriptionUuid\(([^)]*)\)", entity_selector)
+        if match:
+            entities = [entity for entity in entities if self.subscription_uuids.get(entity["subscription"]) == match.group(1)]
+        return entities
+
+    def render(self, entity, fields):
+        result = {"entityId": entity["entityId"], "displayName": entity["displayName"], "type": entity["type"]}
+
+        if "+properties" in fields and entity["type"] == "AZURE_SUBSCRIPTION":
+            result["properties"] = {"azureSubscriptionUuid": self.subscription_uuids[entity["entityId"]]}
+
+        if entity["type"] == "AZURE_SUBSCRIPTION":
+            members = self.members.get(entity["entityId"], [])
+            if "+toRelationships.belongsTo" in fields:
+                result.setdefault("toRelationships", {})["belongsTo"] = [{"id": member["entityId"], "type": member["type"]} for member in members if member["type"] == "CUSTOM_DEVICE"]
+            if "+toRelationships.isAccessibleBy" in fields:
+                result.setdefault("toRelationships", {})["isAccessibleBy"] = [{"id": member["entityId"], "type": member["type"]} for member in members if member["type"] != "CUSTOM_DEVICE"]
+
+        subscription = [{"id": entity["subscription"], "type": "AZURE_SUBSCRIPTION"}] if entity["subscription"] else []
+        if "+fromRelationships.isAccessibleBy" in fields and entity["type"] != "CUSTOM_DEVICE":
+            result.setdefault("fromRelationships", {})["isAccessibleBy"] = [{"id": "AZURE_RESOURCE_GROUP-0000000000000001", "type": "AZURE_RESOURCE_GROUP"}] + subscription
+        if "+fromRelationships.belongsTo" in fields and entity["type"] == "CUSTOM_DEVICE":
+            result.setdefault("fromRelationships", {})["belongsTo"] = subscription
+        return result
+
+    def consumption(self, metric_selector):
+        """
+        Returns the metric series of a DDU metric selector as used by the extension
+        """
+        include_names = ":names" in metric_selector
+        subscription_uuids = re.findall(r"azureSubscriptionUuid\(([^)]*)\)", metric_selector)
+        prefixes = re.findall(r"prefix\(\"dt.entity.monitored_entity\", ?\"?([\w-]+)\"?\)", metric_selector)
+        include_custom_devices = "type(~\"CUSTOM_DEVICE~\")" in metric_selector
+
+        data = []
+        for entity in self.entities.values():
+            if entity["ddus"] is None:
+                continue
+
+            entity_id = entity["entityId"]
+            if entity["type"] == "CUSTOM_DEVICE":
+                if not include_custom_devices or (subscription_uuids and self.subscription_uuids[entity["subscription"]] not in subscription_uuids):
+                    continue
+            elif not any(entity_id.startswith(prefix) for prefix in prefixes):
+                continue
+
+            dimension_map = {"dt.entity.monitored_entity": entity_id}
+            if include_names:
+                dimension_map["dt.entity.monitored_entity.name"] = entity["displayName"]
+            data.append({"dimensions": list(dimension_map.values()), "dimensionMap": dimension_map, "timestamps": [int(time.time() * 1000)], "values": [entity["ddus"]]})
+        return data
+
+
+class MockDynatraceApi(ThreadingHTTPServer):
+    """
+    HTTP server of the mock API
+
+    latency is added to every response, throttle_rate limits the requests per second
+    (exceeding requests get 429 with Retry-After), error_rate returns random 503 responses.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, topology, port = 0, latency = 0.0, throttle_rate = None, error_rate = 0.0, api_token = None):
+        super().__init__(("127.0.0.1", port), MockDynatraceApiHandler)
+        self.topology = topology
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.api_token = api_token
+
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+
+        self.request_count = 0
+        self.throttled_count = 0
+        self.bytes_sent = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset_statistics(self):
+        with self.lock:
+            self.request_count = 0
+            self.throttled_count = 0
+            self.bytes_sent = 0
+
+    def is_throttled(self):
+        with self.lock:
+            self.request_count += 1
+            if self.throttle_rate is None:
+                return False
+
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start = now
+                self.window_requests = 0
+            self.window_requests += 1
+            if self.window_requests <= self.throttle_rate:
+                return False
+
+            self.throttled_count += 1
+            return True
+
+    def paginate(self, kind, items, page_size, next_page_key = None):
+        total_count = len(items) if items is not None else 0
+        if next_page_key:
+            with self.lock:
+                kind, items, page_size, total_count = self.pages.pop(next_page_key)
+
+        page, rest = items[:page_size], items[page_size:]
+        body = {"totalCount": total_count}
+        if rest:
+            next_page_key = uuid.uuid4().hex
+            with self.lock:
+                self.pages[next_page_key] = (kind, rest, page_size, total_count)
+            body["nextPageKey"] = next_page_key
+
+        if kind == "entities":
+            body["entities"] = page
+        else:
+            body["result"] = [{"metricId": "builtin:billing.ddu.metrics.byEntity", "dataPointCountRatio": 0, "dimensionCountRatio": 0, "data": page}]
+        return body
+
+
+class MockDynatraceApiHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.api_token and self.headers.get("Authorization") != f"Api-Token {server.api_token}":
+            return self.respond(401, {"error": {"code": 401, "message": "Missing or invalid API token"}})
+
+        if server.is_throttled():
+            reset = int((server.window_start + 1 - time.monotonic() + time.time()) * 1000000)
+            return self.respond(429, {"error": {"code": 429, "message": "Too Many Requests"}}, {"Retry-After": "1", "X-RateLimit-Limit": str(server.throttle_rate), "X-RateLimit-Reset": str(reset)})
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self.respond(503, {"error": {"code": 503, "message": "Service Unavailable"}})
+
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        next_page_key = params.get("nextPageKey")
+
+        if url.path.endswith("/api/v2/entities"):
+            if next_page_key:
+                body = server.paginate("entities", None, None, next_page_key)
+            else:
+                fields = params.get("fields", "")
+                entities = [server.topology.render(entity, fields) for entity in server.topology.select(params["entitySelector"])]
+                body = server.paginate("entities", entities, min(int(params.get("pageSize", 50)), MAX_ENTITIES_PAGE_SIZE))
+        elif url.path.endswith("/api/v2/metrics/query"):
+            if next_page_key:
+                body = server.paginate("metrics", None, None, next_page_key)
+            else:
+                data = server.topology.consumption(params["metricSelector"])
+                body = server.paginate("metrics", data, min(int(params.get("pageSize", 100)), MAX_METRICS_PAGE_SIZE))
+        else:
+            return self.respond(404, {"error": {"code": 404, "message": "Not found"}})
+
+        self.respond(200, body)
+
+    def respond(self, status, body, headers = None):
+        data = json.dumps(body).encode()
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        if gzipped:
+            data = gzip.compress(data, compresslevel=1)
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+        with self.server.lock:
+            self.server.bytes_sent += len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--subscriptions", type=int, default=10)
+    parser.add_argument("--custom-devices", type=int, default=100, help="Cloud Azure entities per subscription")
+    parser.add_argument("--classic-entities", type=int, default=500, help="entities per Classic type")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=int, default=None, help="requests per second before 429 responses")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    topology = Topology(args.subscriptions, args.custom_devices, args.classic_entities)
+    server = MockDynatraceApi(topology, args.port, args.latency_ms / 1000, args.throttle_rate, args.error_rate)
+    print(f"Serving {len(topology.entities)} entities on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
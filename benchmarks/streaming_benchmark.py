@@ -0,0 +1,167 @@
+"""
+Memory benchmark of the streaming collection pipeline
+
+Compares the peak memory of accumulating all metric rows, entities, records and metric
+lines before reporting (former implementation) with the streaming ConsumptionCollector and
+ReportingPipeline. Pages are generated on the fly by a synthetic API client, which answers
+both the entity listing of the former implementation and the entityId(...) selectors the
+collector resolves Classic entities with. Both modes have to resolve the same subscription
+of every entity.
+
+Reported lines are kept like the extension SDK does (report_mint_lines only extends a
+buffer that is sent every 30 seconds), so both peaks include all lines of the cycle and
+the difference is only the intermediate lists of metric rows, entities and records.
+
+Usage: python benchmarks/streaming_benchmark.py
+"""
+import logging, re, sys, time, tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from azure_ddu_monitoring.api_client import ENTITIES_PAGE_SIZE, METRICS_PAGE_SIZE
+from azure_ddu_monitoring.collection import CollectionEngine, ConsumptionCollector, ConsumptionRecord
+from azure_ddu_monitoring.entity_index import EntityIndex
+from azure_ddu_monitoring.pipeline import ReportingPipeline
+
+SUBSCRIPTION_COUNT = 80
+ENVIRONMENT_URL = "https://benchmark.live.dynatrace.com"
+
+# Entity IDs of an entityId(...) selector
+ENTITY_ID_PATTERN = re.compile(r'"(AZURE_VM-[0-9A-F]{16})"')
+
+# Entity and subscription of a reported line
+LINE_PATTERN = re.compile(r"dt\.entity\.custom_device=([^,]+),.*azure\.subscription\.id=([^,]+)")
+
+
+class SyntheticApiClient:
+    """
+    Yields pages of AZURE_VM entities which all consumed DDUs
+
+    Entities are listed with type(AZURE_VM) or looked up with entityId(...) selectors.
+    """
+
+    def __init__(self, entity_count):
+        self.entity_count = entity_count
+
+    def subscription_entity_id(self, i):
+        return f"AZURE_SUBSCRIPTION-{i % SUBSCRIPTION_COUNT:016X}"
+
+    def iter_entities(self, entity_selector, fields = None, time_from = None, time_to = None):
+        if entity_selector == "type(AZURE_SUBSCRIPTION)":
+            yield [
+                {"entityId": self.subscription_entity_id(i), "displayName": f"subscription-{i}", "properties": {"azureSubscriptionUuid": f"{i:08x}-0000-0000-0000-000000000000"}}
+                for i in range(SUBSCRIPTION_COUNT)
+            ]
+            return
+
+        if entity_selector.startswith("entityId("):
+            indexes = [int(entity_id.split("-")[1], 16) for entity_id in ENTITY_ID_PATTERN.findall(entity_selector)]
+        elif entity_selector == "type(AZURE_VM)":
+            indexes = range(self.entity_count)
+        else:
+            return
+
+        for start in range(0, len(indexes), ENTITIES_PAGE_SIZE):
+            yield [self.entity(i) for i in indexes[start:start + ENTITIES_PAGE_SIZE] if i < self.entity_count]
+
+    def entity(self, i):
+        return {
+            "entityId": f"AZURE_VM-{i:016X}",
+            "displayName": f"vm-{i}",
+            "type": "AZURE_VM",
+            "fromRelationships": {"isAccessibleBy": [{"id": self.subscription_entity_id(i), "type": "AZURE_SUBSCRIPTION"}]}
+        }
+
+    def iter_metric_data(self, metric_selector, time_from, time_to):
+        for start in range(0, self.entity_count, METRICS_PAGE_SIZE):
+            yield [
+                {"dimensionMap": {"dt.entity.monitored_entity": f"AZURE_VM-{i:016X}", "dt.entity.monitored_entity.name": f"vm-{i}"}, "values": [0.25]}
+                for i in range(start, min(start + METRICS_PAGE_SIZE, self.entity_count))
+            ]
+
+
+class Reporter:
+    """
+    Keeps all reported lines like report_mint_lines of the extension SDK
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.lines = []
+
+    def __call__(self, batch):
+        self.lines.extend(batch)
+
+
+def accumulating_cycle(api_client, report):
+    entity_index = EntityIndex()
+    for subscription_entities in api_client.iter_entities("type(AZURE_SUBSCRIPTION)"):
+        entity_index.add_subscriptions(subscription_entities)
+
+    metric_consumption_list = []
+    for metric_data in api_client.iter_metric_data("", None, None):
+        metric_consumption_list.extend(metric_data)
+
+    classic_entities = []
+    for entities in api_client.iter_entities("type(AZURE_VM)"):
+        classic_entities.extend(entities)
+    entity_index.add_entities(classic_entities)
+
+    entity_dict = {}
+    for metric_consumption in metric_consumption_list:
+        entity_id = metric_consumption["dimensionMap"]["dt.entity.monitored_entity"]
+        entity = entity_index.get(entity_id)
+        subscription = entity_index.subscription_of(entity_id)
+        entity_dict[entity_id] = ConsumptionRecord(entity_id, entity["entity_name"], entity["entity_type"], subscription["subscription_id"], subscription["subscription_name"], metric_consumption["values"][0])
+
+    metric_lines = []
+    for record in entity_dict.values():
+        dimensions = f"dt.entity.custom_device={record.entity_id},entity.name={record.entity_name},entity.type={record.entity_type},azure.subscription.id={record.subscription_id},azure.subscription.name={record.subscription_name},environment.url={ENVIRONMENT_URL}"
+        metric_lines.append(f"consumption.ddu.metrics.azure.ddus_by_entity,{dimensions} {record.metric_ddus}")
+
+    for i in range(0, len(metric_lines), 500):
+        report(metric_lines[i:i + 500])
+
+
+def streaming_cycle(api_client, report):
+    collector = ConsumptionCollector(logging.getLogger("benchmark"), api_client, None, None, EntityIndex())
+    pipeline = ReportingPipeline(report, ENVIRONMENT_URL, False)
+    collector.fetch_subscriptions()
+    collector.collect(CollectionEngine(1), pipeline.add)
+    pipeline.finish()
+
+
+def measure(cycle, entity_count):
+    reporter = Reporter()
+    tracemalloc.start()
+    cycle(SyntheticApiClient(entity_count), reporter)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert len(reporter.lines) == entity_count
+    return peak / 2**20, time.perf_counter() - reporter.start, reporter.lines
+
+
+def subscriptions_by_entity(lines):
+    """
+    Returns the reported subscription ID of every entity, asserting all subscriptions were resolved
+    """
+    subscriptions = dict(LINE_PATTERN.search(line).groups() for line in lines)
+    assert "Undefined" not in subscriptions.values()
+    return subscriptions
+
+
+def main():
+    print(f"{'entities':>10} {'mode':>12} {'peak [MiB]':>12} {'total [s]':>10}")
+    for entity_count in (10000, 50000, 100000):
+        subscriptions = []
+        for name, cycle in (("accumulating", accumulating_cycle), ("streaming", streaming_cycle)):
+            peak, total_seconds, lines = measure(cycle, entity_count)
+            print(f"{entity_count:>10} {name:>12} {peak:>12.1f} {total_seconds:>10.3f}")
+            subscriptions.append(subscriptions_by_entity(lines))
+            del lines
+        assert subscriptions[0] == subscriptions[1]
+
+
+if __name__ == "__main__":
+    main()
@@ -27,5 +27,5 @@ setup(name="azure_ddu_monitoring",
           "dt-extensions-sdk",
           "requests"
           ],
-      extras_require={"dev": ["dt-extensions-sdk[cli]"]},
+      extras_require={"dev": ["dt-extensions-sdk[cli]"], "numpy": ["numpy"]},
       )
@@ -0,0 +1,41 @@
+import json
+
+import requests
+
+from azure_ddu_monitoring.cassette import Cassette, CassetteRecorder, ReplaySession
+
+ENVIRONMENT_URL = "https://tenant.live.dynatrace.com"
+PATH = "/api/v2/entities"
+
+
+def entities_response(entity_ids):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps({"entities": [{"entityId": entity_id, "displayName": entity_id.lower()} for entity_id in entity_ids]}).encode("utf-8")
+    return response
+
+
+def entities_params(entity_ids):
+    return {"pageSize": 500, "entitySelector": "entityId(" + ",".join(f"\"{entity_id}\"" for entity_id in entity_ids) + ")", "from": "now-24h", "fields": "+fromRelationships.isAccessibleBy"}
+
+
+def test_entity_requests_are_answered_by_entity_id(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    recorder = CassetteRecorder(path, {"environment_url": ENVIRONMENT_URL})
+    recorder.record(PATH, entities_params(["AZURE_VM-1", "AZURE_VM-2"]), entities_response(["AZURE_VM-1", "AZURE_VM-2"]), 0.1)
+    recorder.record(PATH, entities_params(["AZURE_VM-3"]), entities_response(["AZURE_VM-3"]), 0.2)
+    recorder.close()
+
+    session = ReplaySession(Cassette(path), ENVIRONMENT_URL, latency="zero")
+
+    # Recorded as is
+    response = session.get(ENVIRONMENT_URL + PATH, params=entities_params(["AZURE_VM-3"]))
+    assert [entity["entityId"] for entity in response.json()["entities"]] == ["AZURE_VM-3"]
+
+    # Grouped differently than recorded, unknown IDs are left out
+    response = session.get(ENVIRONMENT_URL + PATH, params=entities_params(["AZURE_VM-2", "AZURE_VM-3", "AZURE_VM-4"]))
+    assert response.status_code == 200
+    assert [entity["entityId"] for entity in response.json()["entities"]] == ["AZURE_VM-2", "AZURE_VM-3"]
+
+    # Other requests still have to be recorded
+    assert session.get(ENVIRONMENT_URL + PATH, params={"entitySelector": "type(AZURE_VM)"}).status_code == 404
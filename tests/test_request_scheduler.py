@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+import requests
+
+from azure_ddu_monitoring.request_scheduler import RequestScheduler
+
+
+def response(status_code):
+    result = requests.Response()
+    result.status_code = status_code
+    return result
+
+
+def test_slots_are_returned_after_non_retryable_errors():
+    budget = threading.BoundedSemaphore(2)
+    scheduler = RequestScheduler(2, max_retries=0, budget=budget)
+
+    def request():
+        raise requests.exceptions.ChunkedEncodingError("connection broken while reading the body")
+
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            scheduler.send(request)
+
+    assert scheduler.active_requests == 0
+    assert budget.acquire(blocking=False) and budget.acquire(blocking=False)
+
+
+def test_slots_are_returned_after_retries_are_exhausted():
+    budget = threading.BoundedSemaphore(1)
+    scheduler = RequestScheduler(1, max_retries=1, backoff_base=0, budget=budget)
+
+    def request():
+        raise requests.ConnectionError()
+
+    with pytest.raises(requests.ConnectionError):
+        scheduler.send(request)
+
+    assert scheduler.request_count == 2
+    assert scheduler.active_requests == 0
+    assert budget.acquire(blocking=False)
+
+
+def test_retryable_responses_are_retried():
+    responses = [response(503), response(200)]
+    scheduler = RequestScheduler(1, backoff_base=0)
+
+    assert scheduler.send(lambda: responses.pop(0)).status_code == 200
+    assert scheduler.retry_count == 1
+    assert scheduler.active_requests == 0
@@ -0,0 +1,29 @@
+import logging, time
+
+from azure_ddu_monitoring.scheduling import CycleDeadline, EndpointScheduler
+
+
+def test_budget_covers_largest_endpoint_limit():
+    assert EndpointScheduler([4, 32], 16).global_max_concurrent_requests == 32
+    assert EndpointScheduler([4], 16).global_max_concurrent_requests == 16
+
+
+def test_cycle_running_past_its_deadline_is_reported(caplog):
+    with caplog.at_level(logging.WARNING):
+        deadline = CycleDeadline("http://tenant", 0.05, logging.getLogger(__name__))
+        time.sleep(0.12)
+        deadline.finish()
+        warnings = len(caplog.records)
+        time.sleep(0.1)
+
+    assert warnings >= 1
+    assert len(caplog.records) == warnings
+    assert "still running" in caplog.records[0].getMessage()
+
+
+def test_cycle_finishing_in_time_is_not_reported(caplog):
+    with caplog.at_level(logging.WARNING):
+        CycleDeadline("http://tenant", 0.1, logging.getLogger(__name__)).finish()
+        time.sleep(0.15)
+
+    assert not caplog.records
@@ -0,0 +1,65 @@
+import logging, sys
+from pathlib import Path
+
+from azure_ddu_monitoring.api_client import DynatraceApiClient
+from azure_ddu_monitoring.metadata_cache import MetadataCache
+from azure_ddu_monitoring.pipeline import run_collection_cycle
+from azure_ddu_monitoring.time_windows import WindowTracker
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+from mock_dynatrace_api import MockDynatraceApi, Topology
+
+# 2024-05-01T12:00:00Z
+NOW = 1714564800
+
+
+def test_first_window_covers_one_interval():
+    assert WindowTracker().pending_windows(900, now=NOW + 30) == [(NOW - 900, NOW)]
+
+
+def test_windows_continue_at_last_committed_window():
+    tracker = WindowTracker()
+    tracker.commit(NOW - 900)
+    assert tracker.pending_windows(900, now=NOW) == [(NOW - 900, NOW)]
+
+    tracker.commit(NOW)
+    assert tracker.pending_windows(900, now=NOW + 59) == []
+
+
+def test_missed_windows_are_caught_up_within_range():
+    tracker = WindowTracker(max_catch_up_seconds=3600)
+    tracker.commit(NOW - 2700 - 120)
+    assert tracker.pending_windows(900, now=NOW) == [(NOW - 2820, NOW - 1800), (NOW - 1800, NOW - 900), (NOW - 900, NOW)]
+
+    tracker.commit(NOW - 7200)
+    assert tracker.pending_windows(900, now=NOW)[0][0] == NOW - 3600
+
+
+def test_failing_persistence_still_commits_window(tmp_path):
+    blocking_file = tmp_path / "file"
+    blocking_file.write_text("")
+
+    tracker = WindowTracker(path=str(blocking_file / "window.json"), logger=logging.getLogger(__name__))
+    tracker.commit(NOW)
+    assert tracker.pending_windows(900, now=NOW) == []
+
+
+def test_window_is_committed_right_after_lines_are_reported(tmp_path):
+    blocking_file = tmp_path / "file"
+    blocking_file.write_text("")
+
+    # Saving the metadata cache fails after the lines were reported
+    metadata_cache = MetadataCache(3600, path=str(blocking_file / "cache.json"))
+
+    events = []
+    server = MockDynatraceApi(Topology(2, 5, 5)).start()
+    api_client = DynatraceApiClient(server.url, "token", True, 2, logging.getLogger(__name__))
+    try:
+        run_collection_cycle(logging.getLogger(__name__), api_client, "2024-05-01T11:45:00.000+00:00", "2024-05-01T12:00:00.000+00:00", lambda lines: events.append(("report", len(lines))), False, 2, metadata_cache, commit=lambda: events.append(("commit", None)))
+    finally:
+        api_client.close()
+        server.shutdown()
+
+    assert [event for event, _ in events] == ["report", "commit"]
+    assert events[0][1] > 0